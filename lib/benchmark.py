@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Scaling benchmark for the template generators
+#
+# Builds every generator against synthetic config modules over a grid of
+# roles x availability zones x public prefixes and records build time,
+# serialization time, peak RSS and template size for each of them.
+#
+import sys
+import json
+import types
+import string
+import argparse
+import resource
+import itertools
+import multiprocessing
+
+# Generators read `config` from sys.modules, the benchmark swaps in its own
+sys.modules["config"] = types.ModuleType("config")
+
+import build
+
+METRICS = ["build", "serialize", "rss", "bytes"]
+
+# Timing differences below this many seconds are noise, not regressions
+NOISE_FLOOR = {"build": 0.005, "serialize": 0.005}
+
+
+def synthetic_config(roles, azs, prefixes):
+    """Returns a config module with the given number of roles, AZs and public prefixes."""
+    config = types.ModuleType("config")
+    config.stackName = "bench"
+    config.environment = "development"
+    config.awsRegion = "eu-west-1"
+    config.availability_zones = ["eu-west-1" + letter for letter in string.ascii_lowercase[:azs]]
+    config.all_availability_zones = list(config.availability_zones)
+    config.s3Bucket = "stackconfig"
+    config.s3CodeBucket = "stackcodebucket"
+    config.s3CodeConfigBucket = "stackcodeconfigbucket"
+    config.privateVpcCidr = "10.10.0.0/16"
+    config.keyName = "ssh-bench"
+    config.public_prefixes = ["pre%d" % i for i in range(prefixes)]
+    config.roles = ["role%d" % i for i in range(roles)]
+
+    config.cidr_map = {}
+    for a, availability_zone in enumerate(config.availability_zones):
+        config.cidr_map[availability_zone] = {"public": {}}
+        for p, prefix in enumerate(config.public_prefixes):
+            config.cidr_map[availability_zone]["public"][prefix] = a * prefixes + p
+
+    config.rolemap = {}
+    for r, role in enumerate(config.roles):
+        subnet = config.public_prefixes[r % prefixes]
+        config.rolemap[role] = {
+            "instance": {
+                "ami": "ami-08935252a36e25f85",
+                "type": "t2.micro",
+                "subnet": subnet,
+                "pp_role": role
+            },
+            "elb": {
+                "subnet": subnet,
+                "healthcheck": "HTTP:80/"
+            },
+            "autoscaling": {
+                "min": 1,
+                "max": 2
+            }
+        }
+
+    return config
+
+
+def measure(name, roles, azs, prefixes, repeat):
+    """Runs in a fresh forked worker so peak RSS belongs to this generator only."""
+    sys.modules["config"] = synthetic_config(roles, azs, prefixes)
+
+    runs = [build.build_template(name) for _ in range(repeat)]
+    return {
+        "template": name,
+        "roles": roles,
+        "azs": azs,
+        "prefixes": prefixes,
+        "build": min(run["build"] for run in runs),
+        "serialize": min(run["serialize"] for run in runs),
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "bytes": len(runs[0]["body"]),
+    }
+
+
+def run_grid(roles, azs, prefixes, templates=build.TEMPLATES, repeat=3):
+    context = multiprocessing.get_context("fork")
+    results = []
+    for r, a, p in itertools.product(roles, azs, prefixes):
+        for name in templates:
+            with context.Pool(1) as pool:
+                results.append(pool.apply(measure, (name, r, a, p, repeat)))
+    return results
+
+
+def result_key(result):
+    return (result["template"], result["roles"], result["azs"], result["prefixes"])
+
+
+def regressions(results, baseline, tolerance):
+    """Returns a line for every tracked metric that grew more than tolerance over the baseline."""
+    previous = dict((result_key(result), result) for result in baseline)
+    problems = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if not old:
+            continue
+        for metric in METRICS:
+            if result[metric] - old[metric] <= NOISE_FLOOR.get(metric, 0):
+                continue
+            if result[metric] > old[metric] * (1 + tolerance):
+                problems.append("%s roles=%d azs=%d prefixes=%d: %s %g -> %g" % (
+                    result["template"], result["roles"], result["azs"], result["prefixes"],
+                    metric, old[metric], result[metric]))
+    return problems
+
+
+def sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark template generation over a topology grid.")
+    parser.add_argument("--roles", type=sizes, default=[1, 4, 16], help="comma separated role counts")
+    parser.add_argument("--azs", type=sizes, default=[2, 3, 6], help="comma separated availability zone counts")
+    parser.add_argument("--prefixes", type=sizes, default=[1, 2, 4], help="comma separated public prefix counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per point, the fastest one is kept")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="where to save the results")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth over the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_grid(args.roles, args.azs, args.prefixes, repeat=args.repeat)
+
+    for result in results:
+        print("%-10s roles=%-3d azs=%-2d prefixes=%-2d build %.3fs  serialize %.3fs  rss %dKB  %d bytes" % (
+            result["template"], result["roles"], result["azs"], result["prefixes"],
+            result["build"], result["serialize"], result["rss"], result["bytes"]))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print("[E] " + problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
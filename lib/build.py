@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#
+# Builds all CloudFormation templates in a single process
+#
+import sys
+import os
+import re
+import json
+import time
+import ast
+import runpy
+import importlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cfn_flip
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
+
+# Loaded once here, generators reuse the cached modules (forked workers too)
+import troposphere
+import config
+import cache
+import shard
+
+LIB_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATES = ["general", "infra", "main", "network"]
+FORMATS = ["json", "compact", "yaml"]
+
+# Warn once a template uses this much of its size budget
+WARN_AT = 0.8
+
+
+def template_path(name):
+    return os.path.join(LIB_DIR, "template-" + name + ".py")
+
+
+def generator_modules(names=TEMPLATES):
+    """troposphere modules the generators import, at the top or in the helpers that load them lazily."""
+    modules = set()
+    for name in names:
+        with open(template_path(name)) as f:
+            tree = ast.parse(f.read(), template_path(name))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("troposphere"):
+                modules.add(node.module)
+            elif isinstance(node, ast.Import):
+                modules.update(alias.name for alias in node.names if alias.name.startswith("troposphere"))
+    return sorted(modules)
+
+
+def preload(names=TEMPLATES):
+    """Imports the generators' troposphere modules, so workers forked afterwards share them."""
+    for module in generator_modules(names):
+        importlib.import_module(module)
+
+
+def build_template(name):
+    """Runs lib/template-<name>.py in this interpreter and serializes its Template."""
+    start = time.time()
+    namespace = runpy.run_path(template_path(name), run_name="template_" + name)
+    built = time.time()
+    body = namespace["t"].to_json()
+    done = time.time()
+
+    return {
+        "name": name,
+        "body": body,
+        "build": built - start,
+        "serialize": done - built,
+    }
+
+
+def run_builds(names, jobs=1):
+    if jobs <= 1 or len(names) <= 1:
+        return [build_template(name) for name in names]
+
+    # fork keeps troposphere and config already imported in the workers
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        return list(executor.map(build_template, names))
+
+
+def build_all(names=TEMPLATES, jobs=1, force=False):
+    """Builds templates whose fingerprint is not cached yet, serves the rest from the cache."""
+    # Whatever config the generators will see, which may be a swapped in variant
+    settings = sys.modules["config"]
+    keys = dict((name, cache.fingerprint(template_path(name), settings)) for name in names)
+
+    results = {}
+    pending = []
+    for name in names:
+        body = None if force else cache.load(name, keys[name])
+        if body is None:
+            pending.append(name)
+        else:
+            results[name] = {"name": name, "body": body, "build": 0.0, "serialize": 0.0, "cached": True}
+
+    for result in run_builds(pending, jobs):
+        cache.store(result["name"], keys[result["name"]], result["body"])
+        result["cached"] = False
+        results[result["name"]] = result
+
+    return [results[name] for name in names]
+
+
+def shard_results(results, max_resources=shard.MAX_RESOURCES, max_bytes=shard.MAX_BYTES):
+    """Splits templates over the CloudFormation limits into parts and rewires main to deploy them."""
+    final = []
+    sharded = {}
+    for result in results:
+        # Parameters have a Type too, so this only ever overestimates the resource count
+        if result["body"].count('"Type": ') <= max_resources and len(result["body"]) <= max_bytes:
+            final.append(result)
+            continue
+
+        template = json.loads(result["body"])
+        if not shard.needs_sharding(template, max_resources, max_bytes, result["body"]):
+            final.append(result)
+            continue
+
+        children = shard.shard(template, max_resources, max_bytes)
+        sharded[result["name"]] = children
+        for i, child in enumerate(children):
+            final.append({
+                "name": shard.shard_name(result["name"], i),
+                "body": shard.dumps(child["template"]),
+                "build": 0.0,
+                "serialize": 0.0,
+                "cached": result.get("cached"),
+                "part_of": result["name"],
+            })
+
+    if not sharded:
+        return final
+
+    main = [result for result in final if result["name"] == "main"]
+    if not main:
+        sys.stderr.write("[W] main was not built, it still deploys unsplit %s\n" % ", ".join(sorted(sharded)))
+        return final
+
+    parent = json.loads(main[0]["body"])
+    for name, children in sorted(sharded.items()):
+        if not shard.wire_parent(parent, name, children):
+            sys.stderr.write("[W] main has no stack for %s.cfn\n" % name)
+    main[0]["body"] = shard.dumps(parent)
+    return final
+
+
+def render(results, output_format="json"):
+    """Converts the pretty printed JSON bodies to the requested output format."""
+    for result in results:
+        if output_format == "json":
+            continue
+        start = time.time()
+        if output_format == "compact":
+            result["body"] = json.dumps(json.loads(result["body"]), sort_keys=True, separators=(',', ':'))
+        else:
+            result["body"] = cfn_flip.to_yaml(result["body"]).rstrip("\n")
+        result["serialize"] += time.time() - start
+    return results
+
+
+def check_sizes(results, budget=shard.MAX_BYTES, warn_at=WARN_AT, strict=False, stream=sys.stderr):
+    """Warns about templates close to the size budget, returns the names that should fail the build."""
+    failed = []
+    for result in results:
+        size = len(result["body"])
+        if size > budget:
+            stream.write("[E] %s is %d bytes, over the %d byte budget\n" % (result["name"], size, budget))
+            failed.append(result["name"])
+        elif size >= budget * warn_at:
+            stream.write("[%s] %s is %d bytes, %d%% of the %d byte budget\n" % (
+                "E" if strict else "W", result["name"], size, 100 * size // budget, budget))
+            if strict:
+                failed.append(result["name"])
+    return failed
+
+
+def write_results(results, output):
+    os.makedirs(output, exist_ok=True)
+    names = set(result["name"] for result in results)
+    for result in results:
+        with open(os.path.join(output, result["name"] + ".cfn"), "w") as f:
+            f.write(result["body"] + "\n")
+
+    # Drop leftovers of an earlier build that was split differently
+    for base in set(result.get("part_of", result["name"]) for result in results):
+        for filename in os.listdir(output):
+            match = re.match(re.escape(base) + r"(-\d+)?\.cfn$", filename)
+            if match and filename[:-len(".cfn")] not in names:
+                os.remove(os.path.join(output, filename))
+
+
+def report(results, elapsed, budget=shard.MAX_BYTES, stream=sys.stderr):
+    for result in results:
+        stream.write("%-10s build %.3fs  serialize %.3fs  %d bytes (%d%%)%s\n" % (
+            result["name"], result["build"], result["serialize"], len(result["body"]),
+            100 * len(result["body"]) // budget,
+            "  (part of %s)" % result["part_of"] if "part_of" in result else
+            "  (cached)" if result.get("cached") else ""))
+    stream.write("%-10s %.3fs\n" % ("total", elapsed))
+
+
+def build(names=TEMPLATES, output="jsons", jobs=1, force=False, max_resources=shard.MAX_RESOURCES,
+          max_bytes=shard.MAX_BYTES, output_format="json", size_budget=shard.MAX_BYTES, strict=False):
+    """The whole pipeline: build (or reuse), split, render, check sizes and write. Returns (results, failed)."""
+    results = build_all(names, jobs, force)
+    results = shard_results(results, max_resources, max_bytes)
+    results = render(results, output_format)
+
+    failed = check_sizes(results, size_budget, strict=strict)
+    if not failed:
+        write_results(results, output)
+    return results, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate all CloudFormation templates in one process.")
+    parser.add_argument("templates", nargs="*", metavar="template",
+                        help="templates to build: " + ", ".join(TEMPLATES) + " (default: all)")
+    parser.add_argument("-o", "--output", default="jsons", help="output directory for .cfn files")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="build templates in parallel processes")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild templates even if they are cached")
+    parser.add_argument("--max-resources", type=int, default=shard.MAX_RESOURCES,
+                        help="split templates with more resources into nested stacks")
+    parser.add_argument("--max-bytes", type=int, default=shard.MAX_BYTES,
+                        help="split templates larger than this into nested stacks")
+    parser.add_argument("--format", default="json", choices=FORMATS,
+                        help="json (indented), compact (minified json) or yaml")
+    parser.add_argument("--size-budget", type=int, default=shard.MAX_BYTES,
+                        help="bytes a template may take, the CloudFormation limit by default")
+    parser.add_argument("--strict", action="store_true",
+                        help="fail instead of warning when a template is close to its size budget")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the timing breakdown")
+    args = parser.parse_args(argv)
+
+    for name in args.templates:
+        if name not in TEMPLATES:
+            parser.error("unknown template: " + name)
+
+    start = time.time()
+    results, failed = build(args.templates or TEMPLATES, args.output, args.jobs, args.force,
+                            args.max_resources, args.max_bytes, args.format, args.size_budget, args.strict)
+
+    if not args.quiet:
+        report(results, time.time() - start, args.size_budget)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
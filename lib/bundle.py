@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Packages the CodeDeploy revision (appspec.yml and scripts/) reproducibly
+# and uploads it under its content hash
+#
+# Entries are sorted and get fixed timestamps and modes (scripts 0755,
+# everything else 0644), so the same content always gives the same zip and
+# the same key. An upload is skipped when s3CodeBucket already has the key,
+# large bundles are streamed in multipart chunks, and --deployment-group only
+# deploys when the group's last successful deployment was another revision.
+#
+import sys
+import os
+import argparse
+import zipfile
+
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+
+import upload
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SOURCES = ["appspec.yml", "scripts"]
+TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+EXECUTABLE = (".sh",)
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+def entries(root=ROOT, sources=SOURCES):
+    """Yields (archive name, path) for every file of the revision, sorted by archive name."""
+    found = []
+    for source in sources:
+        path = os.path.join(root, source)
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                for name in files:
+                    full = os.path.join(directory, name)
+                    found.append((os.path.relpath(full, root).replace(os.sep, "/"), full))
+        else:
+            found.append((source, path))
+    return sorted(found)
+
+
+def write_bundle(output, root=ROOT, sources=SOURCES):
+    """Writes the zip and returns its sha256."""
+    with zipfile.ZipFile(output, "w") as archive:
+        for name, path in entries(root, sources):
+            info = zipfile.ZipInfo(name, TIMESTAMP)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.create_system = 3
+            mode = 0o755 if name.endswith(EXECUTABLE) else 0o644
+            info.external_attr = (0o100000 | mode) << 16
+            with open(path, "rb") as f:
+                archive.writestr(info, f.read(), compresslevel=9)
+    return upload.file_digest(output)
+
+
+def revision_key(digest, prefix=""):
+    return "%s%s.zip" % (prefix, digest)
+
+
+def exists(client, bucket, key):
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def upload_bundle(client, bucket, path, digest, prefix="", force=False, threshold=MULTIPART_THRESHOLD):
+    """Uploads the bundle unless its key is already there, returns (key, uploaded)."""
+    key = revision_key(digest, prefix)
+    if not force and exists(client, bucket, key):
+        return key, False
+    config = TransferConfig(multipart_threshold=threshold, multipart_chunksize=threshold)
+    client.upload_file(path, bucket, key, Config=config,
+                       ExtraArgs={"ContentType": "application/zip", "Metadata": {"sha256": digest}})
+    return key, True
+
+
+def revision(bucket, key):
+    return {"revisionType": "S3", "s3Location": {"bucket": bucket, "key": key, "bundleType": "zip"}}
+
+
+def deployed_key(codedeploy, application, group):
+    """Key of the revision the group last deployed successfully, or None."""
+    info = codedeploy.get_deployment_group(applicationName=application, deploymentGroupName=group)
+    last = info["deploymentGroupInfo"].get("lastSuccessfulDeployment", {}).get("deploymentId")
+    if not last:
+        return None
+    deployment = codedeploy.get_deployment(deploymentId=last)["deploymentInfo"]
+    return deployment.get("revision", {}).get("s3Location", {}).get("key")
+
+
+def deploy(codedeploy, application, group, bucket, key, force=False):
+    """Creates a deployment of the revision unless the group already runs it, returns the id or None."""
+    if not force and deployed_key(codedeploy, application, group) == key:
+        return None
+    response = codedeploy.create_deployment(applicationName=application, deploymentGroupName=group,
+                                            revision=revision(bucket, key))
+    return response["deploymentId"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bundle the CodeDeploy revision and upload it by content hash.")
+    parser.add_argument("-o", "--output", default="revision.zip", help="where to write the bundle")
+    parser.add_argument("-b", "--bucket", help="target bucket (default: s3CodeBucket from config)")
+    parser.add_argument("-p", "--prefix", default="revisions/", help="key prefix inside the bucket")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="only write the bundle and print its hash")
+    parser.add_argument("-f", "--force", action="store_true", help="upload and deploy even if unchanged")
+    parser.add_argument("-d", "--deployment-group", action="append", default=[],
+                        help="deploy the revision to this group of the stack's application, may be repeated")
+    parser.add_argument("--application", help="CodeDeploy application (default: stackName from config)")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local MinIO or moto server")
+    args = parser.parse_args(argv)
+
+    digest = write_bundle(args.output)
+    print("bundle    %s sha256 %s" % (args.output, digest))
+    if args.dry_run:
+        return
+
+    bucket = args.bucket
+    if not bucket:
+        from config import s3CodeBucket as bucket
+
+    key, uploaded = upload_bundle(upload.make_client(args.endpoint_url), bucket, args.output, digest,
+                                  args.prefix, args.force)
+    print("%s s3://%s/%s" % ("uploaded " if uploaded else "unchanged", bucket, key))
+
+    if args.deployment_group:
+        import boto3
+
+        application = args.application
+        if not application:
+            from config import stackName as application
+        codedeploy = boto3.client("codedeploy")
+        for group in args.deployment_group:
+            deployment = deploy(codedeploy, application, group, bucket, key, args.force)
+            if deployment:
+                print("deploying %s to %s" % (deployment, group))
+            else:
+                print("deployed  %s already runs s3://%s/%s" % (group, bucket, key))
+
+
+if __name__ == "__main__":
+    main()
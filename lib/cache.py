@@ -0,0 +1,90 @@
+#
+# Fingerprint based cache for generated templates
+#
+import os
+import ast
+import json
+import types
+import hashlib
+
+import troposphere
+
+LIB_DIR = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.path.join(LIB_DIR, "..", ".buildcache")
+
+
+def source_names(path, seen=None):
+    """Returns (sources, names): the source of a script plus every lib/ module it imports, and all names they load."""
+    seen = seen if seen is not None else set()
+    if path in seen:
+        return [], set()
+    seen.add(path)
+
+    with open(path) as f:
+        source = f.read()
+
+    sources = [source]
+    names = set()
+    for node in ast.walk(ast.parse(source, path)):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            # getattr(config, "name", default) for optional settings
+            names.add(node.value)
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "config":
+            names.add(node.attr)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [node.module] if isinstance(node, ast.ImportFrom) else [a.name for a in node.names]
+            for module in modules:
+                local = os.path.join(LIB_DIR, (module or "") + ".py")
+                if os.path.exists(local):
+                    more_sources, more_names = source_names(local, seen)
+                    sources += more_sources
+                    names |= more_names
+
+    return sources, names
+
+
+def config_inputs(config, names):
+    """Config values a generator actually reads, modules and helpers left out."""
+    values = {}
+    for name in sorted(names):
+        if not hasattr(config, name) or name.startswith("_"):
+            continue
+        value = getattr(config, name)
+        if isinstance(value, types.ModuleType) or callable(value):
+            continue
+        values[name] = value
+    return values
+
+
+def fingerprint(path, config):
+    """Cache key of a generator's JSON, without build options: build.py splits and renders it after the cache."""
+    sources, names = source_names(path)
+    digest = hashlib.sha256()
+    digest.update(troposphere.__version__.encode())
+    for source in sources:
+        digest.update(source.encode())
+    digest.update(json.dumps(config_inputs(config, names), sort_keys=True, default=repr).encode())
+    return digest.hexdigest()
+
+
+def cache_path(name, key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, name + "-" + key + ".cfn")
+
+
+def load(name, key, cache_dir=CACHE_DIR):
+    try:
+        with open(cache_path(name, key, cache_dir)) as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def store(name, key, body, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(name, key, cache_dir)
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as f:
+        f.write(body)
+    os.replace(tmp, path)
@@ -0,0 +1,136 @@
+#
+# Allocates non-overlapping subnets out of the VPC CIDR
+#
+# Every public prefix gets its own region of the VPC, in the order of
+# public_prefixes, with one slot per availability zone letter (a, b, c, ...)
+# of the region's all_availability_zones, rounded up to a power of two.
+# Adding an availability zone or appending a prefix therefore never moves a
+# subnet that is already allocated. Subnets listed in cidr_map are kept where
+# they are and the regions are placed around them.
+#
+# public_prefixes is append-only: the regions are handed out first-fit in its
+# order, so removing or reordering a prefix moves the subnets of every prefix
+# after it. Pin those in cidr_map before taking a prefix out.
+#
+import bisect
+import ipaddress
+
+DEFAULT_SIZE = 24
+# Zone letters a to z
+MAX_AVAILABILITY_ZONES = 26
+
+
+class IntervalIndex(object):
+    """Sorted, non-overlapping address ranges with O(log n) overlap lookups."""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.labels = []
+
+    def overlap(self, network):
+        """Returns (label, last address) of a range overlapping network, or None."""
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        i = bisect.bisect_right(self.starts, last)
+        if i and self.ends[i - 1] >= first:
+            return self.labels[i - 1], self.ends[i - 1]
+        return None
+
+    def add(self, network, label):
+        found = self.overlap(network)
+        if found:
+            raise ValueError("%s (%s) overlaps %s" % (network, label, found[0]))
+        i = bisect.bisect_right(self.starts, int(network.network_address))
+        self.starts.insert(i, int(network.network_address))
+        self.ends.insert(i, int(network.broadcast_address))
+        self.labels.insert(i, label)
+
+
+def legacy_subnet(vpc, octet):
+    """The /24 cidr_map used to describe by its third octet."""
+    parts = str(vpc.network_address).split(".")
+    return ipaddress.ip_network("%s.%s.%s.0/24" % (parts[0], parts[1], octet))
+
+
+def zone_slot(availability_zone, max_availability_zones=MAX_AVAILABILITY_ZONES):
+    slot = ord(availability_zone[-1]) - ord("a")
+    if not 0 <= slot < max_availability_zones:
+        raise ValueError("cannot place availability zone %s in %d slots" % (availability_zone, max_availability_zones))
+    return slot
+
+
+def zone_slots(all_availability_zones, slots=None):
+    """Slots every prefix reserves, one per zone letter of the region rounded up to a power of two, unless given."""
+    if slots:
+        return slots
+    letters = max([zone_slot(name, MAX_AVAILABILITY_ZONES) for name in all_availability_zones] or [0]) + 1
+    return 2 ** (letters - 1).bit_length()
+
+
+def region_step(vpc, prefixlen):
+    return 2 ** (vpc.max_prefixlen - prefixlen)
+
+
+def free_block(vpc, prefixlen, index):
+    """First aligned block of the given size inside vpc that does not overlap the index."""
+    size = region_step(vpc, prefixlen)
+    address = int(vpc.network_address)
+    end = int(vpc.broadcast_address)
+    while True:
+        address = (address + size - 1) // size * size
+        if address + size - 1 > end:
+            raise ValueError("%s has no room left for a /%d, shrink subnet_sizes or availability_zone_slots"
+                             % (vpc, prefixlen))
+        block = vpc.__class__((address, prefixlen))
+        found = index.overlap(block)
+        if not found:
+            return block
+        address = found[1] + 1
+
+
+def allocate(vpc_cidr, availability_zones, prefixes, sizes=None, cidr_map=None, max_availability_zones=None):
+    """
+    Returns {availability zone: {"public": {prefix: cidr}}} for every zone and prefix.
+
+    sizes maps a prefix to its subnet prefix length (/24 by default), cidr_map
+    pins subnets by third octet like the hand maintained table did.
+    max_availability_zones is the number of slots per prefix, see zone_slots()
+    (default: enough for the zones allocated now).
+    """
+    vpc = ipaddress.ip_network(vpc_cidr)
+    sizes = sizes or {}
+    cidr_map = cidr_map or {}
+    max_availability_zones = max_availability_zones or zone_slots(availability_zones)
+    slots_bits = (max_availability_zones - 1).bit_length()
+
+    # Pins of zones not in use yet are reserved too, enabling them later moves nothing
+    reserved = IntervalIndex()
+    pinned = {}
+    for availability_zone in sorted(set(cidr_map) | set(availability_zones)):
+        for prefix in prefixes:
+            octet = cidr_map.get(availability_zone, {}).get("public", {}).get(prefix)
+            if octet is not None:
+                pinned[availability_zone, prefix] = legacy_subnet(vpc, octet)
+                reserved.add(pinned[availability_zone, prefix], availability_zone + " " + prefix)
+
+    subnets = dict((availability_zone, {"public": {}}) for availability_zone in availability_zones)
+
+    # Regions are reserved for every prefix, pinned or not, so later ones never move
+    allocated = IntervalIndex()
+    for prefix in prefixes:
+        size = sizes.get(prefix, DEFAULT_SIZE)
+        region = free_block(vpc, size - slots_bits, reserved)
+        reserved.add(region, prefix)
+
+        for availability_zone in availability_zones:
+            network = pinned.get((availability_zone, prefix))
+            if network is None:
+                slot = zone_slot(availability_zone, max_availability_zones)
+                network = vpc.__class__((int(region.network_address) + slot * region_step(vpc, size), size))
+            if not network.subnet_of(vpc):
+                raise ValueError("%s (%s %s) is outside of %s" % (network, availability_zone, prefix, vpc))
+            allocated.add(network, availability_zone + " " + prefix)
+            subnets[availability_zone]["public"][prefix] = str(network)
+
+    return subnets
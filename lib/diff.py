@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# Structural diff of CloudFormation templates
+#
+# Compares a freshly generated template (or directory of them) with an earlier
+# build or a saved copy of the deployed template, and reports added, removed
+# and modified resources by logical ID. Modified properties that make
+# CloudFormation replace the resource are flagged, including resources that
+# get replaced because something they point at is replaced.
+#
+import sys
+import os
+import json
+import hashlib
+import argparse
+
+import cfn_flip
+
+import shard
+
+# Properties whose update replaces the resource, "*" means every property does
+REPLACEMENT = {
+    "AWS::AutoScaling::AutoScalingGroup": ["AutoScalingGroupName"],
+    "AWS::AutoScaling::LaunchConfiguration": ["*"],
+    "AWS::AutoScaling::ScheduledAction": ["AutoScalingGroupName"],
+    "AWS::AutoScaling::WarmPool": ["AutoScalingGroupName"],
+    "AWS::CloudWatch::Alarm": ["AlarmName"],
+    "AWS::CodeDeploy::Application": ["ApplicationName", "ComputePlatform"],
+    "AWS::CodeDeploy::DeploymentConfig": ["*"],
+    "AWS::CodeDeploy::DeploymentGroup": ["ApplicationName", "DeploymentGroupName"],
+    "AWS::EC2::LaunchTemplate": ["LaunchTemplateName"],
+    "AWS::EC2::PlacementGroup": ["Strategy"],
+    "AWS::EC2::Route": ["DestinationCidrBlock", "DestinationIpv6CidrBlock", "RouteTableId"],
+    "AWS::EC2::RouteTable": ["VpcId"],
+    "AWS::EC2::SecurityGroup": ["GroupDescription", "GroupName", "VpcId"],
+    "AWS::EC2::SecurityGroupIngress": ["CidrIp", "CidrIpv6", "FromPort", "GroupId", "GroupName", "IpProtocol",
+                                       "SourceSecurityGroupId", "SourceSecurityGroupName", "ToPort"],
+    "AWS::EC2::Subnet": ["AvailabilityZone", "CidrBlock", "VpcId"],
+    "AWS::EC2::SubnetRouteTableAssociation": ["RouteTableId", "SubnetId"],
+    "AWS::EC2::VPC": ["CidrBlock", "InstanceTenancy"],
+    "AWS::EC2::VPCGatewayAttachment": ["VpcId"],
+    "AWS::EFS::FileSystem": ["Encrypted", "KmsKeyId", "PerformanceMode"],
+    "AWS::EFS::MountTarget": ["FileSystemId", "IpAddress", "SubnetId"],
+    "AWS::ElastiCache::CacheCluster": ["AZMode", "CacheSubnetGroupName", "ClusterName", "Engine", "Port",
+                                       "PreferredAvailabilityZone", "PreferredAvailabilityZones"],
+    "AWS::ElastiCache::ParameterGroup": ["CacheParameterGroupFamily", "Description"],
+    "AWS::ElastiCache::ReplicationGroup": ["CacheSubnetGroupName", "Engine", "Port", "ReplicationGroupId"],
+    "AWS::ElastiCache::SubnetGroup": ["CacheSubnetGroupName"],
+    "AWS::ElasticLoadBalancing::LoadBalancer": ["LoadBalancerName", "Scheme"],
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": ["Name", "Scheme", "Type"],
+    "AWS::ElasticLoadBalancingV2::TargetGroup": ["Name", "Port", "Protocol", "ProtocolVersion", "TargetType", "VpcId"],
+    "AWS::IAM::InstanceProfile": ["InstanceProfileName", "Path"],
+    "AWS::IAM::Role": ["Path", "RoleName"],
+}
+
+
+def digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def load(path):
+    with open(path) as f:
+        template, _ = cfn_flip.load(f.read())
+    return json.loads(json.dumps(template))
+
+
+def forces_replacement(resource_type, properties):
+    replaced = REPLACEMENT.get(resource_type, [])
+    if "*" in replaced:
+        return list(properties)
+    return [name for name in properties if name in replaced]
+
+
+def diff_section(old, new):
+    """Returns (added, removed, modified) names of a template section, compared by subtree hash."""
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    modified = [name for name in new if name in old and digest(new[name]) != digest(old[name])]
+    return added, removed, modified
+
+
+def diff_templates(old, new):
+    """Returns a dict describing how new differs from old."""
+    old_resources = old.get("Resources", {})
+    new_resources = new.get("Resources", {})
+    added, removed, modified = diff_section(old_resources, new_resources)
+
+    changes = []
+    replaced = set(added) | set(removed)
+    for name in sorted(modified):
+        before = old_resources[name]
+        after = new_resources[name]
+        old_properties = before.get("Properties", {})
+        new_properties = after.get("Properties", {})
+        properties = sorted(set(old_properties) | set(new_properties))
+        properties = [p for p in properties if digest(old_properties.get(p)) != digest(new_properties.get(p))]
+
+        if before.get("Type") != after.get("Type"):
+            replacement = ["Type"]
+        else:
+            replacement = forces_replacement(after.get("Type"), properties)
+        if replacement:
+            replaced.add(name)
+
+        changes.append({
+            "name": name,
+            "type": after.get("Type"),
+            "properties": properties,
+            "other": sorted(key for key in set(before) | set(after)
+                            if key not in ("Type", "Properties") and digest(before.get(key)) != digest(after.get(key))),
+            "replacement": replacement,
+        })
+
+    # A replaced resource gets a new physical ID: whatever points at it through a
+    # replacing property is replaced as well, anything else pointing at it is updated
+    dependents = {}
+    for name, resource in new_resources.items():
+        properties = resource.get("Properties", {})
+        forcing = forces_replacement(resource.get("Type"), properties)
+        for prop, value in properties.items():
+            for other in shard.references(value):
+                dependents.setdefault(other, []).append((name, prop in forcing))
+
+    cascaded = {}
+    updated = {}
+    queue = sorted(replaced)
+    while queue:
+        name = queue.pop()
+        for dependent, forces in dependents.get(name, []):
+            if dependent in replaced:
+                continue
+            if forces:
+                replaced.add(dependent)
+                cascaded[dependent] = name
+                queue.append(dependent)
+            else:
+                updated.setdefault(dependent, name)
+
+    changed = set(change["name"] for change in changes)
+    for name in sorted(set(cascaded) | set(updated)):
+        if name not in changed and name in new_resources:
+            changes.append({"name": name, "type": new_resources[name].get("Type"), "properties": [],
+                            "other": [], "replacement": []})
+    for change in changes:
+        if change["name"] in cascaded:
+            change["replaced_by"] = cascaded[change["name"]]
+        elif change["name"] in updated and not change["replacement"]:
+            change["updated_by"] = updated[change["name"]]
+
+    result = {
+        "added": [{"name": name, "type": new_resources[name].get("Type")} for name in sorted(added)],
+        "removed": [{"name": name, "type": old_resources[name].get("Type")} for name in sorted(removed)],
+        "modified": changes,
+    }
+    for section in ("Parameters", "Outputs"):
+        section_added, section_removed, section_modified = diff_section(old.get(section, {}), new.get(section, {}))
+        result[section.lower()] = {"added": sorted(section_added), "removed": sorted(section_removed),
+                                   "modified": sorted(section_modified)}
+    return result
+
+
+def is_empty(result):
+    return not (result["added"] or result["removed"] or result["modified"] or
+                any(result[section][kind] for section in ("parameters", "outputs")
+                    for kind in ("added", "removed", "modified")))
+
+
+def replacements(result):
+    return [change for change in result["modified"] if change["replacement"] or "replaced_by" in change]
+
+
+def pairs(old, new):
+    """Yields (label, old path or None, new path or None) for two files or two directories."""
+    if not os.path.isdir(new):
+        yield os.path.basename(new), old, new
+        return
+    names = set(name for name in os.listdir(new) if name.endswith(".cfn"))
+    if os.path.isdir(old):
+        names |= set(name for name in os.listdir(old) if name.endswith(".cfn"))
+    for name in sorted(names):
+        old_path = os.path.join(old, name)
+        new_path = os.path.join(new, name)
+        yield name, old_path if os.path.exists(old_path) else None, new_path if os.path.exists(new_path) else None
+
+
+def print_result(label, result, stream=sys.stdout):
+    if is_empty(result):
+        return
+    stream.write(label + "\n")
+    for item in result["added"]:
+        stream.write("  + %s (%s)\n" % (item["name"], item["type"]))
+    for item in result["removed"]:
+        stream.write("  - %s (%s)\n" % (item["name"], item["type"]))
+    for change in result["modified"]:
+        details = ", ".join(change["properties"] + change["other"])
+        if change["replacement"]:
+            details += "  [replacement: %s]" % ", ".join(change["replacement"])
+        elif "replaced_by" in change:
+            details += "  [replacement: follows %s]" % change["replaced_by"]
+        elif "updated_by" in change:
+            details += "  [update: follows %s]" % change["updated_by"]
+        stream.write("  ~ %s (%s) %s\n" % (change["name"], change["type"], details.strip()))
+    for section in ("parameters", "outputs"):
+        for kind, mark in (("added", "+"), ("removed", "-"), ("modified", "~")):
+            for name in result[section][kind]:
+                stream.write("  %s %s %s\n" % (mark, section[:-1], name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff generated templates against an earlier or deployed copy.")
+    parser.add_argument("old", help="earlier template, or directory of .cfn files")
+    parser.add_argument("new", nargs="?", default="jsons", help="new template or directory (default: jsons)")
+    parser.add_argument("--json", action="store_true", help="print the diff as JSON")
+    parser.add_argument("--fail-on-replacement", action="store_true",
+                        help="exit with 2 when a resource would be replaced")
+    args = parser.parse_args(argv)
+
+    empty = {}
+    results = {}
+    for label, old, new in pairs(args.old, args.new):
+        results[label] = diff_templates(load(old) if old else empty, load(new) if new else empty)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        for label in sorted(results):
+            print_result(label, results[label])
+
+    if args.fail_on_replacement and any(replacements(result) for result in results.values()):
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# Offline evaluator for CloudFormation intrinsic functions
+#
+# Resolves a generated template against parameter values into concrete
+# resources, without creating a stack. Ref and GetAtt of resources resolve to
+# stub values (or ones passed in), GetAtt(stack, "Outputs.x") of nested stacks
+# resolves from stubbed outputs or by evaluating the child template itself.
+#
+import sys
+import re
+import json
+import base64
+import argparse
+
+import diff
+import validate
+
+SUB_VARIABLE = re.compile(r"\$\{([^}]*)\}")
+NO_VALUE = object()
+
+
+class Evaluator(object):
+    """Resolves Ref, Fn::GetAtt, Fn::Join, Fn::Split, Fn::Sub, Fn::Base64 and friends in one template."""
+
+    def __init__(self, template, parameters=None, stack_name="stack", region="eu-west-1",
+                 account_id="123456789012", attributes=None, outputs=None, templates=None, exports=None):
+        self.template = template
+        self.stack_name = stack_name
+        self.region = region
+        self.account_id = account_id
+        self.attributes = attributes or {}
+        self.outputs = outputs or {}
+        self.templates = templates or {}
+        self.exports = exports or {}
+        self.parameters = self.resolve_parameters(parameters or {})
+        self.conditions = {}
+        self.children = {}
+
+    def resolve_parameters(self, values):
+        resolved = {}
+        for name, parameter in self.template.get("Parameters", {}).items():
+            if name in values:
+                value = values[name]
+            elif "Default" in parameter:
+                value = parameter["Default"]
+            else:
+                raise ValueError("parameter %s has no value and no default" % name)
+
+            allowed = parameter.get("AllowedValues")
+            if allowed and value not in allowed:
+                raise ValueError("parameter %s: %r is not one of %s" % (name, value, ", ".join(allowed)))
+            if parameter.get("Type") == "CommaDelimitedList" and isinstance(value, str):
+                value = value.split(",")
+            resolved[name] = value
+
+        unknown = set(values) - set(resolved)
+        if unknown:
+            raise ValueError("unknown parameters: " + ", ".join(sorted(unknown)))
+        return resolved
+
+    def pseudo(self, name):
+        return {
+            "AWS::AccountId": self.account_id,
+            "AWS::NoValue": NO_VALUE,
+            "AWS::Partition": "aws",
+            "AWS::Region": self.region,
+            "AWS::StackId": "arn:aws:cloudformation:%s:%s:stack/%s/stub" % (self.region, self.account_id, self.stack_name),
+            "AWS::StackName": self.stack_name,
+            "AWS::URLSuffix": "amazonaws.com",
+        }[name]
+
+    def ref(self, name):
+        if name in self.parameters:
+            return self.parameters[name]
+        if name.startswith("AWS::"):
+            return self.pseudo(name)
+        if name in self.template.get("Resources", {}):
+            return self.attributes.get(name, {}).get("Ref", name)
+        raise ValueError("Ref to unknown %s" % name)
+
+    def get_att(self, name, attribute):
+        resources = self.template.get("Resources", {})
+        if name not in resources:
+            raise ValueError("GetAtt of unknown resource %s" % name)
+
+        if resources[name].get("Type") == "AWS::CloudFormation::Stack" and attribute.startswith("Outputs."):
+            outputs = self.stack_outputs(name)
+            output = attribute[len("Outputs."):]
+            if output not in outputs:
+                raise ValueError("stack %s has no output %s" % (name, output))
+            return outputs[output]
+
+        return self.attributes.get(name, {}).get(attribute, "%s.%s" % (name, attribute))
+
+    def child_template(self, name):
+        return validate.child_template(self.template, self.template["Resources"][name], self.templates)
+
+    def stack(self, name):
+        """Evaluates the template a nested Stack resource deploys, with the parameters it passes."""
+        if name not in self.children:
+            child = self.child_template(name)
+            if not child:
+                raise ValueError("no outputs stubbed and no template found for stack %s" % name)
+            parameters = self.resolve(self.template["Resources"][name].get("Properties", {}).get("Parameters", {}))
+            evaluator = Evaluator(self.templates[child], parameters, self.stack_name + "-" + name, self.region,
+                                  self.account_id, templates=self.templates, exports=self.exports)
+            self.children[name] = evaluator.evaluate()
+        return self.children[name]
+
+    def stack_outputs(self, name):
+        """Stubbed outputs of a nested stack, or the ones its template evaluates to."""
+        if name in self.outputs:
+            return self.outputs[name]
+        return self.stack(name)["Outputs"]
+
+    def condition(self, name):
+        if name not in self.conditions:
+            self.conditions[name] = bool(self.resolve(self.template["Conditions"][name]))
+        return self.conditions[name]
+
+    def sub(self, value):
+        text, variables = value if isinstance(value, list) else (value, {})
+        variables = self.resolve(variables)
+
+        def replace(match):
+            variable = match.group(1)
+            if variable.startswith("!"):
+                return "${" + variable[1:] + "}"
+            if variable in variables:
+                return str(variables[variable])
+            if "." in variable:
+                return str(self.get_att(*variable.split(".", 1)))
+            return str(self.ref(variable))
+
+        return SUB_VARIABLE.sub(replace, text)
+
+    def function(self, key, value):
+        if key == "Ref":
+            return self.ref(value)
+        if key == "Fn::GetAtt":
+            name, attribute = value if isinstance(value, list) else value.split(".", 1)
+            return self.get_att(name, attribute)
+        if key == "Fn::Sub":
+            return self.sub(value)
+        if key == "Condition":
+            return self.condition(value)
+        if key == "Fn::If":
+            name, when_true, when_false = value
+            return self.resolve(when_true if self.condition(name) else when_false)
+
+        args = self.resolve(value)
+        if key == "Fn::Join":
+            return args[0].join(str(item) for item in args[1])
+        if key == "Fn::Split":
+            return args[1].split(args[0])
+        if key == "Fn::Select":
+            return args[1][int(args[0])]
+        if key == "Fn::Base64":
+            return base64.b64encode(args.encode()).decode()
+        if key == "Fn::FindInMap":
+            return self.template["Mappings"][args[0]][args[1]][args[2]]
+        if key == "Fn::GetAZs":
+            return [(args or self.region) + zone for zone in "abc"]
+        if key == "Fn::ImportValue":
+            if args not in self.exports:
+                raise ValueError("nothing exports " + args)
+            return self.exports[args]
+        if key == "Fn::Equals":
+            return args[0] == args[1]
+        if key == "Fn::Not":
+            return not args[0]
+        if key == "Fn::And":
+            return all(args)
+        if key == "Fn::Or":
+            return any(args)
+        raise ValueError("unsupported function " + key)
+
+    def resolve(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1:
+                key = list(value)[0]
+                if key == "Ref" or key.startswith("Fn::") or key == "Condition":
+                    return self.function(key, value[key])
+            resolved = {}
+            for key, item in value.items():
+                item = self.resolve(item)
+                if item is not NO_VALUE:
+                    resolved[key] = item
+            return resolved
+        if isinstance(value, list):
+            return [item for item in (self.resolve(item) for item in value) if item is not NO_VALUE]
+        return value
+
+    def evaluate(self):
+        """Returns {"Parameters", "Conditions", "Resources", "Outputs", "Stacks"} with every intrinsic resolved."""
+        resources = {}
+        for name, resource in self.template.get("Resources", {}).items():
+            if "Condition" in resource and not self.condition(resource["Condition"]):
+                continue
+            resolved = dict((key, value) for key, value in resource.items() if key != "Properties")
+            resolved["Properties"] = self.resolve(resource.get("Properties", {}))
+            resources[name] = resolved
+
+        stacks = {}
+        for name, resource in resources.items():
+            if resource.get("Type") == "AWS::CloudFormation::Stack" and name not in self.outputs \
+                    and self.child_template(name):
+                stacks[name] = self.stack(name)
+
+        outputs = {}
+        for name, output in self.template.get("Outputs", {}).items():
+            if "Condition" in output and not self.condition(output["Condition"]):
+                continue
+            outputs[name] = self.resolve(output["Value"])
+
+        return {
+            "Parameters": self.parameters,
+            "Conditions": dict((name, self.condition(name)) for name in self.template.get("Conditions", {})),
+            "Resources": resources,
+            "Outputs": outputs,
+            "Stacks": stacks,
+        }
+
+
+def evaluate(template, parameters=None, **kwargs):
+    return Evaluator(template, parameters, **kwargs).evaluate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resolve a template's intrinsic functions locally.")
+    parser.add_argument("template", help="template to evaluate")
+    parser.add_argument("-p", "--parameter", action="append", default=[], metavar="NAME=VALUE",
+                        help="parameter value, may be repeated")
+    parser.add_argument("--templates", help="build directory to evaluate nested stacks from")
+    parser.add_argument("--outputs", help="JSON file with stubbed {stack: {output: value}} nested stack outputs")
+    parser.add_argument("--region", default="eu-west-1")
+    parser.add_argument("--stack-name", default="stack")
+    args = parser.parse_args(argv)
+
+    parameters = dict(item.split("=", 1) for item in args.parameter)
+    outputs = None
+    if args.outputs:
+        with open(args.outputs) as f:
+            outputs = json.load(f)
+    templates = validate.load_build(args.templates) if args.templates else None
+
+    result = evaluate(diff.load(args.template), parameters, stack_name=args.stack_name, region=args.region,
+                      outputs=outputs, templates=templates)
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
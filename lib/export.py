@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+#
+# Validates config.py once and prints the requested settings in one call
+#
+#   eval "$(lib/export.py s3Bucket s3CodeBucket)"   # shell export lines
+#   lib/export.py --format json                    # every setting as JSON
+#
+# The validated settings are cached in .buildcache/ by the hash of config.py
+# and of the validation code, so repeated calls do not import or validate it
+# again until either changes.
+#
+import sys
+import os
+import json
+import re
+import shlex
+import hashlib
+import argparse
+import ipaddress
+
+LIB_DIR = os.path.abspath(os.path.dirname(__file__))
+CONFIG_PATH = os.path.join(LIB_DIR, "..", "config", "config.py")
+CACHE_DIR = os.path.join(LIB_DIR, "..", ".buildcache")
+
+sys.path.append(os.path.join(LIB_DIR, "..", "config"))
+
+ENVIRONMENTS = ["production", "development"]
+DEPLOYMENT_STRATEGIES = ["one-at-a-time", "half-at-a-time", "all-at-once"]
+TRACKED_METRICS = ["cpu", "network_in", "network_out", "requests"]
+STEP_AGGREGATIONS = ["Average", "Minimum", "Maximum"]
+ELB_TYPES = ["classic", "alb"]
+ALB_ALGORITHMS = ["round_robin", "least_outstanding_requests"]
+# Settings of the ALB itself, the same for every role sharing it
+ALB_SHARED = ["https", "http2", "idle_timeout"]
+CACHE_ENGINES = ["redis", "memcached"]
+EFS_PERFORMANCE_MODES = ["generalPurpose", "maxIO"]
+EFS_THROUGHPUT_MODES = ["bursting", "provisioned", "elastic"]
+ORIGIN_PROTOCOLS = ["http-only", "https-only", "match-viewer"]
+VIEWER_PROTOCOLS = ["allow-all", "redirect-to-https", "https-only"]
+VOLUME_TYPES = ["gp3", "gp2", "io1", "io2", "st1", "sc1", "standard"]
+PLACEMENT_STRATEGIES = ["cluster", "spread"]
+SPOT_ALLOCATIONS = ["capacity-optimized", "lowest-price"]
+REQUIRED = {
+    "stackName": str,
+    "environment": str,
+    "awsRegion": str,
+    "availability_zones": list,
+    "all_availability_zones": list,
+    "s3Bucket": str,
+    "s3CodeBucket": str,
+    "s3CodeConfigBucket": str,
+    "privateVpcCidr": str,
+    "keyName": str,
+    "roles": list,
+    "public_prefixes": list,
+    "rolemap": dict,
+}
+
+
+def check(settings):
+    """Returns a list of problems with a {name: value} config."""
+    errors = []
+    for name, kind in sorted(REQUIRED.items()):
+        if name not in settings:
+            errors.append("%s is missing" % name)
+        elif not isinstance(settings[name], kind):
+            errors.append("%s should be a %s" % (name, kind.__name__))
+    if errors:
+        return errors
+
+    # stackName and role names end up in logical IDs, which must be alphanumeric
+    if not settings["stackName"].isalnum():
+        errors.append("stackName %r must be alphanumeric" % settings["stackName"])
+    if settings["environment"] not in ENVIRONMENTS:
+        errors.append("environment must be one of " + ", ".join(ENVIRONMENTS))
+    for availability_zone in settings["availability_zones"]:
+        if not availability_zone.startswith(settings["awsRegion"]):
+            errors.append("availability zone %s is not in %s" % (availability_zone, settings["awsRegion"]))
+        if availability_zone not in settings["all_availability_zones"]:
+            errors.append("availability zone %s is not in all_availability_zones" % availability_zone)
+    try:
+        ipaddress.ip_network(settings["privateVpcCidr"])
+    except ValueError as e:
+        errors.append("privateVpcCidr: %s" % e)
+
+    for role in settings["roles"]:
+        if not role.isalnum():
+            errors.append("role %r must be alphanumeric" % role)
+        if role not in settings["rolemap"]:
+            errors.append("role %s has no rolemap entry" % role)
+            continue
+        roleconfig = settings["rolemap"][role]
+        for section, keys in (("instance", ["ami", "type", "subnet", "pp_role"]), ("autoscaling", ["min", "max"])):
+            for key in keys:
+                if key not in roleconfig.get(section, {}):
+                    errors.append("rolemap %s: %s.%s is missing" % (role, section, key))
+        instance = roleconfig.get("instance", {})
+        if "subnet" in instance and instance["subnet"] not in settings["public_prefixes"]:
+            errors.append("rolemap %s: instance subnet is not one of public_prefixes" % role)
+        if "elb" in roleconfig and roleconfig["elb"].get("subnet") not in settings["public_prefixes"]:
+            errors.append("rolemap %s: elb subnet is not one of public_prefixes" % role)
+        errors += check_alb(role, roleconfig.get("elb", {}))
+        errors += check_efs(role, roleconfig.get("efs"))
+        if "launch_template" in roleconfig:
+            errors += check_launch_template(role, roleconfig["launch_template"], settings["availability_zones"],
+                                            "warm_pool" in roleconfig.get("autoscaling", {}))
+        if "cdn" in roleconfig:
+            errors += check_cdn(role, roleconfig["cdn"], roleconfig.get("elb"))
+        cache = roleconfig.get("cache", {})
+        if cache.get("engine", "redis") not in CACHE_ENGINES:
+            errors.append("rolemap %s: cache engine must be one of %s" % (role, ", ".join(CACHE_ENGINES)))
+        if not isinstance(cache.get("nodes", 1), int) or cache.get("nodes", 1) < 1:
+            errors.append("rolemap %s: cache nodes must be a positive number" % role)
+        for availability_zone in cache.get("availability_zones", []):
+            if availability_zone not in settings["availability_zones"]:
+                errors.append("rolemap %s: cache availability zone %s is not in availability_zones" % (
+                    role, availability_zone))
+        deployment = roleconfig.get("deployment", {})
+        if "strategy" in deployment and deployment["strategy"] not in DEPLOYMENT_STRATEGIES:
+            errors.append("rolemap %s: deployment strategy must be one of %s" % (
+                role, ", ".join(DEPLOYMENT_STRATEGIES)))
+        elif "minimum_healthy" in deployment and not re.match(r"^(\d+|\d{1,2}%|100%)$",
+                                                               str(deployment["minimum_healthy"])):
+            errors.append("rolemap %s: deployment minimum_healthy must be a host count or a percentage" % role)
+        elif deployment and "strategy" not in deployment and "minimum_healthy" not in deployment:
+            errors.append("rolemap %s: deployment needs a strategy or minimum_healthy" % role)
+        autoscaling = roleconfig.get("autoscaling", {})
+        tracked = set()
+        for policy in autoscaling.get("target_tracking", []):
+            if policy.get("metric") not in TRACKED_METRICS:
+                errors.append("rolemap %s: target_tracking metric must be one of %s" % (
+                    role, ", ".join(TRACKED_METRICS)))
+            elif policy["metric"] in tracked:
+                # The policy's logical ID is made from the metric
+                errors.append("rolemap %s: target_tracking %s is listed twice" % (role, policy["metric"]))
+            tracked.add(policy.get("metric"))
+            if policy.get("metric") == "requests" and roleconfig.get("elb", {}).get("type") != "alb":
+                errors.append("rolemap %s: target_tracking requests needs an alb" % role)
+            if "target" not in policy:
+                errors.append("rolemap %s: target_tracking %s has no target" % (role, policy.get("metric")))
+        for policy in autoscaling.get("step", []):
+            if "metric" not in policy or "threshold" not in policy or not policy.get("steps"):
+                errors.append("rolemap %s: step policies need a metric, threshold and steps" % role)
+            if policy.get("aggregation", "Average") not in STEP_AGGREGATIONS:
+                errors.append("rolemap %s: step aggregation must be one of %s" % (role, ", ".join(STEP_AGGREGATIONS)))
+        for action in autoscaling.get("scheduled", []):
+            if not str(action.get("name", "")).isalnum() or "recurrence" not in action:
+                errors.append("rolemap %s: scheduled actions need an alphanumeric name and a recurrence" % role)
+        if isinstance(autoscaling.get("min"), int) and isinstance(autoscaling.get("max"), int) \
+                and autoscaling["min"] > autoscaling["max"]:
+            errors.append("rolemap %s: autoscaling min is larger than max" % role)
+
+    # Roles sharing an ALB share its subnets and its listener
+    albs = {}
+    for role in settings["roles"]:
+        elb = settings["rolemap"].get(role, {}).get("elb", {})
+        if elb.get("type") == "alb":
+            albs.setdefault(elb.get("alb", role), []).append((role, elb))
+    errors += check_alb_listeners(albs)
+
+    slots = settings.get("availability_zone_slots")
+    if slots is not None and (not isinstance(slots, int) or slots < 1 or slots & (slots - 1)):
+        errors.append("availability_zone_slots must be a power of two")
+
+    if not errors:
+        import cidr
+        try:
+            cidr.allocate(settings["privateVpcCidr"], settings["availability_zones"], settings["public_prefixes"],
+                          settings.get("subnet_sizes"), settings.get("cidr_map"),
+                          cidr.zone_slots(settings["all_availability_zones"], slots))
+        except ValueError as e:
+            errors.append("subnets: %s" % e)
+
+    return errors
+
+
+def check_alb(role, elb):
+    errors = []
+    if elb.get("type", "classic") not in ELB_TYPES:
+        errors.append("rolemap %s: elb type must be one of %s" % (role, ", ".join(ELB_TYPES)))
+    if elb.get("type") != "alb":
+        return errors
+    if not str(elb.get("alb", role)).isalnum():
+        errors.append("rolemap %s: alb name must be alphanumeric" % role)
+    if elb.get("algorithm", "round_robin") not in ALB_ALGORITHMS:
+        errors.append("rolemap %s: elb algorithm must be one of %s" % (role, ", ".join(ALB_ALGORITHMS)))
+    if "slow_start" in elb and elb.get("algorithm") == "least_outstanding_requests":
+        errors.append("rolemap %s: slow_start does not work with least_outstanding_requests" % role)
+    if "https" in elb and "certificate" not in elb["https"]:
+        errors.append("rolemap %s: elb https needs a certificate ARN" % role)
+    if "rules" in elb and not (elb["rules"].get("paths") or elb["rules"].get("hosts")):
+        errors.append("rolemap %s: elb rules need paths or hosts" % role)
+    return errors
+
+
+def check_alb_listeners(albs):
+    """Checks the roles of every ALB, {name: [(role, elb)]} in role order, the way template-infra.py adds them."""
+    import topology
+
+    errors = []
+    priorities = [0]
+    for name, members in albs.items():
+        if len(set(elb.get("subnet") for _, elb in members)) > 1:
+            errors.append("alb %s: its roles use different subnets" % name)
+        # The listener and the ALB attributes come from the first role, the others would be ignored
+        first, settings = members[0]
+        for role, elb in members[1:]:
+            for key in ALB_SHARED:
+                if elb.get(key) != settings.get(key):
+                    errors.append("alb %s: %s has a different %s than %s, the first role on the alb" % (
+                        name, role, key, first))
+        # Only one role can take the listener's default action, the others would never get traffic
+        default = [role for role, elb in members if "rules" not in elb]
+        if len(default) > 1:
+            errors.append("alb %s: only one role can go without rules, %s do" % (name, ", ".join(default)))
+        used = {}
+        for role, elb in members:
+            if "rules" not in elb:
+                continue
+            for priority in topology.rule_priorities(elb["rules"], priorities):
+                if priority in used:
+                    errors.append("alb %s: rule priority %d of %s is already used by %s" % (
+                        name, priority, role, used[priority]))
+                used.setdefault(priority, role)
+    return errors
+
+
+def check_efs(role, efs):
+    errors = []
+    if efs is None:
+        return errors
+    if not str(efs.get("name", role)).isalnum():
+        errors.append("rolemap %s: efs name must be alphanumeric" % role)
+    if not efs.get("mount", "/srv/shared").startswith("/"):
+        errors.append("rolemap %s: efs mount must be an absolute path" % role)
+    if efs.get("performance_mode", "generalPurpose") not in EFS_PERFORMANCE_MODES:
+        errors.append("rolemap %s: efs performance_mode must be one of %s" % (role, ", ".join(EFS_PERFORMANCE_MODES)))
+    if efs.get("throughput_mode", "bursting") not in EFS_THROUGHPUT_MODES:
+        errors.append("rolemap %s: efs throughput_mode must be one of %s" % (role, ", ".join(EFS_THROUGHPUT_MODES)))
+    if efs.get("throughput_mode") == "provisioned" and "throughput" not in efs:
+        errors.append("rolemap %s: provisioned efs throughput needs throughput (MiB/s)" % role)
+    if efs.get("throughput_mode") == "elastic" and efs.get("performance_mode") == "maxIO":
+        errors.append("rolemap %s: elastic efs throughput needs the generalPurpose performance mode" % role)
+    return errors
+
+
+def check_launch_template(role, launch_template, availability_zones, warm_pool):
+    errors = []
+    volumes = [dict({"device": "/dev/xvda", "size": 10}, **launch_template.get("root_volume", {}))]
+    for volume in volumes + launch_template.get("volumes", []):
+        device = volume.get("device", "volume")
+        if "device" not in volume or "size" not in volume:
+            errors.append("rolemap %s: launch_template volumes need a device and size" % role)
+        volume_type = volume.get("type", "gp3")
+        if volume_type not in VOLUME_TYPES:
+            errors.append("rolemap %s: %s type must be one of %s" % (role, device, ", ".join(VOLUME_TYPES)))
+        if "throughput" in volume and (volume_type != "gp3" or not 125 <= volume["throughput"] <= 1000):
+            errors.append("rolemap %s: %s throughput needs gp3 and 125 to 1000 MiB/s" % (role, device))
+        if "iops" in volume and volume_type not in ("gp3", "io1", "io2"):
+            errors.append("rolemap %s: %s iops needs a gp3, io1 or io2 volume" % (role, device))
+    placement_group = launch_template.get("placement_group")
+    if placement_group and placement_group not in PLACEMENT_STRATEGIES:
+        errors.append("rolemap %s: placement_group must be one of %s" % (role, ", ".join(PLACEMENT_STRATEGIES)))
+    if placement_group == "cluster" and len(availability_zones) > 1:
+        errors.append("rolemap %s: a cluster placement_group needs a single availability zone" % role)
+    if launch_template.get("spot_allocation", "capacity-optimized") not in SPOT_ALLOCATIONS:
+        errors.append("rolemap %s: spot_allocation must be one of %s" % (role, ", ".join(SPOT_ALLOCATIONS)))
+    if not 0 <= launch_template.get("on_demand_percentage", 100) <= 100:
+        errors.append("rolemap %s: on_demand_percentage must be 0 to 100" % role)
+    mixed = set(launch_template) & {"instance_types", "on_demand_base", "on_demand_percentage", "spot_allocation",
+                                    "spot_max_price"}
+    if mixed and warm_pool:
+        errors.append("rolemap %s: a warm_pool does not work with instance_types or spot settings" % role)
+    return errors
+
+
+def check_cdn(role, cdn, elb):
+    errors = []
+    if not elb:
+        errors.append("rolemap %s: cdn needs an elb as its origin" % role)
+    if cdn.get("origin_protocol", "http-only") not in ORIGIN_PROTOCOLS:
+        errors.append("rolemap %s: cdn origin_protocol must be one of %s" % (role, ", ".join(ORIGIN_PROTOCOLS)))
+    elif cdn.get("origin_protocol") == "http-only" and elb and elb.get("type") == "alb" and "https" in elb:
+        errors.append("rolemap %s: cdn origin_protocol http-only gets redirected past the cdn by the alb's https, "
+                      "leave it unset" % role)
+    if not 1 <= cdn.get("keepalive", 5) <= 60:
+        errors.append("rolemap %s: cdn keepalive must be 1 to 60 seconds" % role)
+    if not 1 <= cdn.get("read_timeout", 30) <= 60:
+        errors.append("rolemap %s: cdn read_timeout must be 1 to 60 seconds" % role)
+    if cdn.get("aliases") and "certificate" not in cdn:
+        errors.append("rolemap %s: cdn aliases need a certificate" % role)
+    if not cdn.get("certificate", "arn:aws:acm:us-east-1:").startswith("arn:aws:acm:us-east-1:"):
+        errors.append("rolemap %s: cdn certificate must be an ACM certificate in us-east-1" % role)
+    for behavior in [cdn] + cdn.get("behaviors", []):
+        name = "default behavior" if behavior is cdn else behavior.get("path", "behavior")
+        if behavior is not cdn and "path" not in behavior:
+            errors.append("rolemap %s: cdn behaviors need a path" % role)
+        if behavior.get("viewer_protocol", "redirect-to-https") not in VIEWER_PROTOCOLS:
+            errors.append("rolemap %s: cdn %s viewer_protocol must be one of %s" % (
+                role, name, ", ".join(VIEWER_PROTOCOLS)))
+        if not behavior.get("min_ttl", 0) <= behavior.get("default_ttl", 0) <= behavior.get("max_ttl", 31536000):
+            errors.append("rolemap %s: cdn %s needs min_ttl <= default_ttl <= max_ttl" % (role, name))
+    return errors
+
+
+# The validation code and the topology helpers it shares with the generators, a change to them
+# invalidates the cached results
+VALIDATORS = [os.path.join(LIB_DIR, name) for name in ("export.py", "cidr.py", "topology.py")]
+
+
+def config_digest(path=CONFIG_PATH, validators=VALIDATORS):
+    digest = hashlib.sha256()
+    for source in [path] + validators:
+        with open(source, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def module_settings(config):
+    """The {name: value} settings of a config module, leaving out what JSON cannot hold (imports, helpers)."""
+    settings = {}
+    for name, value in vars(config).items():
+        if name.startswith("_"):
+            continue
+        try:
+            settings[name] = json.loads(json.dumps(value))
+        except TypeError:
+            continue
+    return settings
+
+
+def load_settings(path=CONFIG_PATH, cache_dir=CACHE_DIR):
+    """Returns the validated settings, from the cache when config.py did not change. Raises ValueError."""
+    cached = os.path.join(cache_dir, "config-" + config_digest(path) + ".json")
+    if os.path.exists(cached):
+        with open(cached) as f:
+            return json.load(f)
+
+    import config
+    settings = module_settings(config)
+
+    errors = check(settings)
+    if errors:
+        raise ValueError("\n".join(errors))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = cached + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as f:
+        json.dump(settings, f, sort_keys=True)
+    os.replace(tmp, cached)
+    return settings
+
+
+def shell_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return " ".join(value)
+    return json.dumps(value, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate config.py and print settings in one call.")
+    parser.add_argument("names", nargs="*", metavar="name", help="settings to print (default: all)")
+    parser.add_argument("--format", default="shell", choices=["shell", "json"],
+                        help="shell export lines (lists space separated, dicts as JSON) or a JSON object")
+    args = parser.parse_args(argv)
+
+    try:
+        settings = load_settings()
+    except ValueError as e:
+        for line in str(e).splitlines():
+            sys.stderr.write("[E] config: %s\n" % line)
+        sys.exit(1)
+
+    for name in args.names:
+        if name not in settings:
+            sys.stderr.write("[E] config: no such setting %s\n" % name)
+            sys.exit(1)
+    names = args.names or sorted(settings)
+
+    if args.format == "json":
+        json.dump(dict((name, settings[name]) for name in names), sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        for name in names:
+            sys.stdout.write("export %s=%s\n" % (name, shlex.quote(shell_value(settings[name]))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Import-time regression check for the template generators
+#
+# Runs every lib/template-*.py under `python -X importtime` and fails when a
+# generator loads a troposphere resource module it does not emit resources
+# from, or when its imports take longer than the given budget.
+#
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+LIB_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATES = ["general", "infra", "main", "network"]
+
+# troposphere modules that hold helpers rather than AWS resources
+SUPPORT_MODULES = ["compat", "policies", "utils", "validators"]
+
+
+def parse_importtime(stderr):
+    """Returns [(module, cumulative us, parent module)] from -X importtime output."""
+    modules = []
+    pending = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        name = name.strip()
+
+        # Children are printed before their parent, one level deeper
+        for child in [entry for entry in pending if entry[0] == depth + 1]:
+            modules.append((child[1], child[2], name))
+            pending.remove(child)
+        pending.append((depth, name, int(cumulative)))
+
+    modules += [(name, cumulative, None) for depth, name, cumulative in pending]
+    return modules
+
+
+def emitted_services(body):
+    template = json.loads(body)
+    return set(r["Type"].split("::")[1].lower() for r in template.get("Resources", {}).values())
+
+
+def check_template(name, budget=None, python=sys.executable):
+    process = subprocess.run(
+        [python, "-X", "importtime", os.path.join(LIB_DIR, "template-" + name + ".py")],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    modules = parse_importtime(process.stderr)
+    services = emitted_services(process.stdout)
+
+    problems = []
+    for module, cumulative, parent in modules:
+        if not module.startswith("troposphere."):
+            continue
+        if parent and parent.startswith("troposphere"):
+            continue
+        submodule = module.split(".")[1]
+        if submodule not in SUPPORT_MODULES and submodule not in services:
+            problems.append("imports %s but emits no %s resources" % (module, submodule))
+
+    total = sum(cumulative for module, cumulative, parent in modules if parent is None) / 1000.0
+    if budget is not None and total > budget:
+        problems.append("imports took %.1fms, budget is %.1fms" % (total, budget))
+
+    return total, problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check generator imports with python -X importtime.")
+    parser.add_argument("templates", nargs="*", metavar="template",
+                        help="templates to check: " + ", ".join(TEMPLATES) + " (default: all)")
+    parser.add_argument("--budget", type=float, help="fail when a generator's imports take longer (ms)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name in args.templates or TEMPLATES:
+        total, problems = check_template(name, args.budget)
+        print("%-10s %.1fms" % (name, total))
+        for problem in problems:
+            print("  [E] " + problem)
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
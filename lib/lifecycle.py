@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Runs the appspec.yml hooks locally, in CodeDeploy lifecycle order
+#
+#   lib/lifecycle.py --stub aws --stub service --stub puppet -o hooks.json
+#
+# Every hook script gets its declared timeout and runas user, the
+# environment variables the CodeDeploy agent sets, and its output captured.
+# --stub NAME[=EXIT] puts a stand-in for a command first on PATH that logs
+# its arguments and exits with EXIT (0 by default); --stub-dir adds a
+# directory of hand written stubs. Durations, output and stub calls of each
+# hook are written as JSON, so the hooks can be timed in a container.
+#
+import sys
+import os
+import json
+import time
+import shutil
+import signal
+import getpass
+import argparse
+import tempfile
+import subprocess
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# In-place EC2 deployment order, hooks CodeDeploy runs itself are left out
+LIFECYCLE = [
+    "BeforeBlockTraffic",
+    "AfterBlockTraffic",
+    "ApplicationStop",
+    "BeforeInstall",
+    "AfterInstall",
+    "ApplicationStart",
+    "ValidateService",
+    "BeforeAllowTraffic",
+    "AfterAllowTraffic",
+]
+DEFAULT_TIMEOUT = 3600
+STUB = """#!/bin/sh
+echo "%s $*" >> "%s"
+exit %d
+"""
+
+
+def load_hooks(appspec):
+    """Returns [(event, [{location, timeout, runas}])] in lifecycle order."""
+    with open(appspec) as f:
+        spec = yaml.safe_load(f)
+    hooks = spec.get("hooks") or {}
+    unknown = set(hooks) - set(LIFECYCLE)
+    if unknown:
+        raise ValueError("unknown lifecycle events: " + ", ".join(sorted(unknown)))
+    return [(event, hooks[event] or []) for event in LIFECYCLE if event in hooks]
+
+
+def make_stubs(directory, stubs, calls):
+    for stub in stubs:
+        name, _, code = stub.partition("=")
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(STUB % (name, calls, int(code or 0)))
+        os.chmod(path, 0o755)
+
+
+def command(path, runas):
+    """The command line for a hook script, switching user when that is needed and possible."""
+    if os.access(path, os.X_OK):
+        args = [path]
+    else:
+        # Checkouts do not always keep the executable bit, use the shebang
+        with open(path) as f:
+            first = f.readline()
+        args = (first[2:].split() if first.startswith("#!") else ["/bin/sh"]) + [path]
+
+    if runas and runas != getpass.getuser():
+        if os.geteuid() != 0:
+            sys.stderr.write("[W] not root, running %s as %s instead of %s\n" % (path, getpass.getuser(), runas))
+        else:
+            args = ["runuser", "-u", runas, "--"] + args
+    return args
+
+
+def run_hook(root, event, hook, env, calls):
+    path = os.path.join(root, hook["location"])
+    timeout = hook.get("timeout", DEFAULT_TIMEOUT)
+    open(calls, "w").close()
+
+    start = time.time()
+    process = subprocess.Popen(command(path, hook.get("runas")), cwd=root, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        output, _ = process.communicate(timeout=timeout)
+        status = "Succeeded" if process.returncode == 0 else "Failed"
+    except subprocess.TimeoutExpired:
+        # The agent kills the whole script, children included
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+        status = "TimedOut"
+
+    with open(calls) as f:
+        stub_calls = f.read().splitlines()
+
+    return {
+        "event": event,
+        "location": hook["location"],
+        "runas": hook.get("runas"),
+        "timeout": timeout,
+        "status": status,
+        "exit_code": process.returncode,
+        "seconds": time.time() - start,
+        "output": output.decode(errors="replace"),
+        "stub_calls": stub_calls,
+    }
+
+
+def run(root=ROOT, appspec=None, stubs=(), stub_dirs=(), events=None, application="local", group="local"):
+    """Runs the hooks until one fails, returns their results."""
+    hooks = load_hooks(appspec or os.path.join(root, "appspec.yml"))
+    stub_dir = tempfile.mkdtemp(prefix="lifecycle-")
+    calls = os.path.join(stub_dir, "calls.log")
+    make_stubs(stub_dir, stubs, calls)
+
+    env = dict(os.environ)
+    env["PATH"] = os.pathsep.join([stub_dir] + list(stub_dirs) + [env.get("PATH", "")])
+    env.update({
+        "APPLICATION_NAME": application,
+        "DEPLOYMENT_GROUP_NAME": group,
+        "DEPLOYMENT_GROUP_ID": "local",
+        "DEPLOYMENT_ID": "d-LOCAL%d" % int(time.time()),
+    })
+
+    results = []
+    try:
+        for event, entries in hooks:
+            if events and event not in events:
+                continue
+            env["LIFECYCLE_EVENT"] = event
+            for hook in entries:
+                results.append(run_hook(root, event, hook, env, calls))
+                if results[-1]["status"] != "Succeeded":
+                    return results
+    finally:
+        shutil.rmtree(stub_dir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the appspec.yml hooks locally with timing.")
+    parser.add_argument("--root", default=ROOT, help="revision directory (default: the repository)")
+    parser.add_argument("--appspec", help="appspec file (default: ROOT/appspec.yml)")
+    parser.add_argument("--stub", action="append", default=[], metavar="NAME[=EXIT]",
+                        help="replace a command with a stub that logs its arguments, may be repeated")
+    parser.add_argument("--stub-dir", action="append", default=[], help="directory of custom stubs put on PATH")
+    parser.add_argument("--event", action="append", help="only run this lifecycle event, may be repeated")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print each hook's output")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    results = run(args.root, args.appspec, args.stub, args.stub_dir, args.event)
+    total = time.time() - start
+
+    for result in results:
+        print("%-18s %-28s %8.3fs  %s" % (result["event"], result["location"], result["seconds"], result["status"]))
+        if args.verbose or result["status"] != "Succeeded":
+            for line in result["output"].splitlines():
+                print("    " + line)
+    print("%-47s %8.3fs" % ("total", total))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"hooks": results, "seconds": total}, f, indent=2, sort_keys=True)
+
+    sys.exit(0 if all(result["status"] == "Succeeded" for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
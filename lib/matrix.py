@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# Builds the template set of every variant in a config matrix in one run
+#
+# The matrix file (YAML or JSON) overrides config.py per variant:
+#
+#   defaults:                   # applied to every variant
+#     keyName: ssh-deploy
+#   matrix:                     # cartesian product, variant names are joined labels
+#     region:
+#       eu: {awsRegion: eu-west-1, availability_zones: [eu-west-1a, eu-west-1b]}
+#       us: {awsRegion: us-east-1, availability_zones: [us-east-1a, us-east-1b],
+#            all_availability_zones: [us-east-1a, us-east-1b, us-east-1c]}
+#     env:
+#       dev: {environment: development}
+#       prod: {environment: production, rolemap: {microService: {autoscaling: {min: 2, max: 6}}}}
+#   variants:                   # explicitly named variants, on top of the product
+#     staging: {stackName: staging, environment: development}
+#
+# Dict values are merged into config, anything else replaces it. Variants
+# without a stackName of their own get config's stackName plus the variant
+# name. Every variant is written to <output>/<variant>/ and a summary goes to
+# <output>/manifest.json. Every variant is validated like config.py before
+# any of them is built.
+#
+import sys
+import os
+import re
+import copy
+import json
+import time
+import types
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+import build
+import export
+
+
+def merge(base, overrides):
+    """Returns base with overrides applied, dicts merged key by key."""
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def expand(spec, base_stack_name):
+    """Returns {variant name: config overrides} for a matrix spec."""
+    defaults = spec.get("defaults", {})
+    variants = {}
+
+    axes = spec.get("matrix", {})
+    if axes:
+        names = list(axes)
+        for labels in itertools.product(*(list(axes[name]) for name in names)):
+            overrides = defaults
+            for name, label in zip(names, labels):
+                overrides = merge(overrides, axes[name][label] or {})
+            variants["-".join(str(label) for label in labels)] = overrides
+
+    for name, overrides in spec.get("variants", {}).items():
+        variants[name] = merge(defaults, overrides or {})
+
+    for name, overrides in variants.items():
+        if "stackName" not in overrides:
+            overrides["stackName"] = base_stack_name + re.sub("[^A-Za-z0-9]", "", name)
+
+    return variants
+
+
+def variant_config(base, overrides):
+    """A config module for one variant: everything from base with the overrides merged in."""
+    values = dict((key, value) for key, value in vars(base).items()
+                  if not key.startswith("_") and not isinstance(value, types.ModuleType))
+    settings = types.ModuleType("config")
+    for key, value in merge(values, overrides).items():
+        setattr(settings, key, value)
+    return settings
+
+
+def check_variants(base, variants):
+    """Raises ValueError for invalid variants, and for two deploying the same stack name into one region."""
+    errors = []
+    for name in sorted(variants):
+        errors += ["variant %s: %s" % (name, error)
+                   for error in export.check(export.module_settings(variant_config(base, variants[name])))]
+    if errors:
+        raise ValueError("\n".join(errors))
+
+    # They would clash on their exports
+    seen = {}
+    for name in sorted(variants):
+        settings = variant_config(base, variants[name])
+        key = (settings.stackName, settings.awsRegion)
+        if key in seen:
+            raise ValueError("variants %s and %s both deploy stack %s to %s" % (seen[key], name, key[0], key[1]))
+        seen[key] = name
+
+
+def build_variant(name, overrides, output, options):
+    """Runs in a forked worker: swaps in the variant's config and runs the whole build pipeline."""
+    # Workers are reused, so always start from config.py rather than the last variant
+    sys.modules["config"] = variant_config(build.config, overrides)
+
+    start = time.time()
+    results, failed = build.build(output=os.path.join(output, name), **options)
+    return {
+        "variant": name,
+        "overrides": overrides,
+        "seconds": time.time() - start,
+        "failed": failed,
+        "templates": dict((result["name"], {
+            "bytes": len(result["body"]),
+            "sha256": hashlib.sha256(result["body"].encode()).hexdigest(),
+            "cached": bool(result.get("cached")),
+        }) for result in results),
+    }
+
+
+def build_matrix(variants, output, jobs=None, **options):
+    # fork hands every worker the troposphere modules the parent already imported,
+    # so load the ones the generators use first instead of once per worker
+    build.preload()
+    context = multiprocessing.get_context("fork")
+    names = sorted(variants)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        futures = [executor.submit(build_variant, name, variants[name], output, options) for name in names]
+        return [future.result() for future in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build templates for every variant of a config matrix.")
+    parser.add_argument("matrix", help="YAML or JSON matrix file")
+    parser.add_argument("-o", "--output", default="jsons", help="output directory, one subdirectory per variant")
+    parser.add_argument("-j", "--jobs", type=int, help="variants built in parallel (default: CPU count)")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild templates even if they are cached")
+    parser.add_argument("--format", default="json", choices=build.FORMATS,
+                        help="json (indented), compact (minified json) or yaml")
+    parser.add_argument("--only", action="append", help="only build this variant, may be repeated")
+    args = parser.parse_args(argv)
+
+    with open(args.matrix) as f:
+        spec = yaml.safe_load(f)
+
+    variants = expand(spec, build.config.stackName)
+    if args.only:
+        variants = dict((name, variants[name]) for name in args.only)
+    try:
+        check_variants(build.config, variants)
+    except ValueError as e:
+        for line in str(e).splitlines():
+            sys.stderr.write("[E] matrix: %s\n" % line)
+        sys.exit(1)
+
+    start = time.time()
+    summary = build_matrix(variants, args.output, args.jobs, force=args.force, output_format=args.format)
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "manifest.json"), "w") as f:
+        json.dump({"variants": summary, "seconds": time.time() - start}, f, indent=2, sort_keys=True)
+
+    failed = False
+    for variant in summary:
+        print("%-20s %.3fs  %d templates%s" % (variant["variant"], variant["seconds"], len(variant["templates"]),
+                                              "  [E] over size budget: " + ", ".join(variant["failed"])
+                                              if variant["failed"] else ""))
+        failed = failed or bool(variant["failed"])
+    print("%-20s %.3fs" % ("total", time.time() - start))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#
+# --profile mode shared by the template-*.py generators
+#
+#   lib/template-network.py --profile > network.cfn
+#   lib/template-infra.py --profile --cprofile infra.prof --collapsed infra.folded > infra.cfn
+#
+# Times the import, construct, validate (to_dict), serialize and write phases,
+# counts resources per type and records peak RSS. The report goes to stderr
+# and every run is appended as one JSON line to profile.jsonl. --cprofile
+# dumps cProfile stats (for pstats/snakeviz), --collapsed samples the stack
+# every millisecond into collapsed stacks for flamegraph.pl or speedscope.
+#
+import sys
+import os
+import json
+import time
+import signal
+import hashlib
+import argparse
+import resource
+import collections
+
+LIB_DIR = os.path.abspath(os.path.dirname(__file__))
+PROFILE_LOG = os.path.join(LIB_DIR, "..", "profile.jsonl")
+SAMPLE_INTERVAL = 0.001
+
+current = None
+
+
+class Profiler(object):
+    """Phase timings, peak memory and optional cProfile/stack samples of one generator run."""
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.phases = []
+        self.started = time.time()
+        self.cprofile = None
+        self.samples = collections.Counter()
+
+        if options.cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if options.collapsed:
+            signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        self.phase("import")
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def phase(self, name):
+        """Ends the running phase and starts the next one."""
+        self.close()
+        self.phases.append({"name": name, "start": time.time()})
+
+    def close(self):
+        if self.phases and "seconds" not in self.phases[-1]:
+            self.phases[-1]["seconds"] = time.time() - self.phases[-1]["start"]
+            self.phases[-1]["rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def finish(self, template, body):
+        self.close()
+        if self.options.collapsed:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            with open(self.options.collapsed, "w") as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write("%s %d\n" % (stack, count))
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.options.cprofile)
+
+        record = self.record(template, body)
+        report(record)
+        with open(self.options.profile_log, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+        return record
+
+    def record(self, template, body):
+        import troposphere
+
+        types = collections.Counter(r.resource_type for r in template.resources.values())
+        settings = sys.modules.get("config")
+        config_digest = None
+        if getattr(settings, "__file__", None):
+            with open(settings.__file__, "rb") as f:
+                config_digest = hashlib.sha256(f.read()).hexdigest()[:12]
+
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "template": self.name,
+            "phases": dict((phase["name"], phase["seconds"]) for phase in self.phases),
+            "phase_rss_kb": dict((phase["name"], phase["rss_kb"]) for phase in self.phases),
+            "total": sum(phase["seconds"] for phase in self.phases),
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "resources": dict(types),
+            "resource_count": len(template.resources),
+            "parameters": len(template.parameters),
+            "outputs": len(template.outputs),
+            "bytes": len(body),
+            "samples": sum(self.samples.values()),
+            "config": config_digest,
+            "python": "%d.%d.%d" % sys.version_info[:3],
+            "troposphere": troposphere.__version__,
+        }
+
+
+def report(record, stream=sys.stderr):
+    stream.write("[profile] %s\n" % record["template"])
+    for name, seconds in record["phases"].items():
+        stream.write("  %-10s %8.3fs  rss %7.1f MB\n" % (name, seconds, record["phase_rss_kb"][name] / 1024.0))
+    stream.write("  %-10s %8.3fs  peak rss %.1f MB, %d bytes\n" % (
+        "total", record["total"], record["peak_rss_kb"] / 1024.0, record["bytes"]))
+    stream.write("  %d resources: %s\n" % (record["resource_count"], ", ".join(
+        "%s %d" % item for item in sorted(record["resources"].items(), key=lambda item: (-item[1], item[0])))))
+
+
+def start(run_name):
+    """Called first thing by a generator; profiles it when run as a script with --profile."""
+    global current
+    if run_name != "__main__":
+        return
+
+    parser = argparse.ArgumentParser(description="Print the CloudFormation template to stdout.")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase, count resources and report peak memory on stderr")
+    parser.add_argument("--profile-log", default=PROFILE_LOG, help="JSON lines log every profiled run is appended to")
+    parser.add_argument("--cprofile", metavar="PATH", help="also write cProfile stats to PATH")
+    parser.add_argument("--collapsed", metavar="PATH", help="also write sampled collapsed stacks to PATH")
+    options = parser.parse_args()
+
+    if options.profile or options.cprofile or options.collapsed:
+        name = os.path.basename(sys.argv[0])[len("template-"):-len(".py")]
+        current = Profiler(name, options)
+
+
+def phase(name):
+    if current:
+        current.phase(name)
+
+
+def output(template):
+    """Prints the template, timing validation, serialization and the write when profiling."""
+    if not current:
+        print(template.to_json())
+        return
+
+    # Same output as Template.to_json(), split so validation and json.dumps are timed apart
+    current.phase("validate")
+    data = template.to_dict()
+    current.phase("serialize")
+    body = json.dumps(data, indent=4, sort_keys=True, separators=(',', ': '))
+    current.phase("write")
+    print(body)
+    sys.stdout.flush()
+    current.finish(template, body)
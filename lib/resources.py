@@ -0,0 +1,56 @@
+#
+# CloudFormation types the pinned troposphere (2.4.2) does not know yet
+#
+# Declared, or extended, the way troposphere declares its own, so they validate and
+# serialize like any other resource. Drop them once troposphere is upgraded.
+#
+from troposphere import AWSObject, AWSProperty, Tags, ec2
+from troposphere.validators import boolean, integer
+
+
+class InstanceReusePolicy(AWSProperty):
+    props = {
+        "ReuseOnScaleIn": (boolean, False),
+    }
+
+
+class WarmPool(AWSObject):
+    resource_type = "AWS::AutoScaling::WarmPool"
+
+    props = {
+        "AutoScalingGroupName": (str, True),
+        "InstanceReusePolicy": (InstanceReusePolicy, False),
+        "MaxGroupPreparedCapacity": (integer, False),
+        "MinSize": (integer, False),
+        "PoolState": (str, False),
+    }
+
+
+def throughput_mode(mode):
+    # troposphere 2.4.2 predates elastic throughput
+    if mode not in ("bursting", "provisioned", "elastic"):
+        raise ValueError('ThroughputMode must be one of: "bursting, provisioned, elastic"')
+    return mode
+
+
+class FileSystem(AWSObject):
+    resource_type = "AWS::EFS::FileSystem"
+
+    props = {
+        "Encrypted": (boolean, False),
+        "FileSystemTags": (Tags, False),
+        "KmsKeyId": (str, False),
+        "PerformanceMode": (str, False),
+        "ProvisionedThroughputInMibps": (float, False),
+        "ThroughputMode": (throughput_mode, False),
+    }
+
+
+class EBSBlockDevice(ec2.EBSBlockDevice):
+    # gp3 volumes take their throughput (MiB/s) separately from the IOPS
+    props = dict(ec2.EBSBlockDevice.props, KmsKeyId=(str, False), Throughput=(integer, False))
+
+
+class IamInstanceProfile(ec2.IamInstanceProfile):
+    # Launch templates also take the profile by name, which is what the general stack exports
+    props = dict(ec2.IamInstanceProfile.props, Name=(str, False))
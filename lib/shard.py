@@ -0,0 +1,362 @@
+#
+# Splits templates over the CloudFormation limits into nested child stacks
+#
+# Resources that reference each other are kept in the same child stack where
+# possible. When a group has to be split anyway, the references that cross
+# child stacks become an Output of one child and a Parameter of the other, and
+# the parent Stack resource in the main template is replaced by one Stack per
+# child with that wiring filled in.
+#
+import re
+import copy
+import json
+
+MAX_RESOURCES = 500
+MAX_BYTES = 1024 * 1024
+MAX_PARAMETERS = 200
+MAX_OUTPUTS = 200
+
+# Room left in every child for the parameters and outputs added by the wiring
+HEADROOM = 0.9
+
+SUB_VARIABLE = re.compile(r"\$\{([^!}][^}]*)\}")
+
+
+def dumps(template):
+    """Serializes a template dict the same way troposphere's Template.to_json() does."""
+    return json.dumps(template, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+def sub_parts(value):
+    if isinstance(value, list):
+        return value[0], value[1]
+    return value, {}
+
+
+def references(value, found=None):
+    """Returns the logical IDs a value points at through Ref, Fn::GetAtt and Fn::Sub."""
+    found = found if found is not None else set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "Ref":
+                found.add(item)
+            elif key == "Fn::GetAtt":
+                found.add(item[0] if isinstance(item, list) else item.split(".")[0])
+            elif key == "Fn::Sub":
+                text, variables = sub_parts(item)
+                for variable in SUB_VARIABLE.findall(text):
+                    if variable not in variables:
+                        found.add(variable.split(".")[0])
+                references(variables, found)
+            else:
+                references(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            references(item, found)
+    return found
+
+
+def rewrite(value, resolve):
+    """Returns a copy of value where resolve(logical id, attribute) may swap references for a parameter name."""
+    if isinstance(value, dict):
+        if len(value) == 1 and "Ref" in value:
+            name = resolve(value["Ref"], None)
+            return {"Ref": name or value["Ref"]}
+        if len(value) == 1 and "Fn::GetAtt" in value:
+            target = value["Fn::GetAtt"]
+            resource, attribute = target if isinstance(target, list) else target.split(".", 1)
+            name = resolve(resource, attribute)
+            return {"Ref": name} if name else copy.deepcopy(value)
+        if len(value) == 1 and "Fn::Sub" in value:
+            text, variables = sub_parts(value["Fn::Sub"])
+
+            def replace(match):
+                variable = match.group(1)
+                if variable in variables:
+                    return match.group(0)
+                resource, _, attribute = variable.partition(".")
+                name = resolve(resource, attribute or None)
+                return "${" + name + "}" if name else match.group(0)
+
+            text = SUB_VARIABLE.sub(replace, text)
+            if isinstance(value["Fn::Sub"], list):
+                return {"Fn::Sub": [text, rewrite(variables, resolve)]}
+            return {"Fn::Sub": text}
+        return dict((key, rewrite(item, resolve)) for key, item in value.items())
+    if isinstance(value, list):
+        return [rewrite(item, resolve) for item in value]
+    return value
+
+
+def depends_on(resource):
+    value = resource.get("DependsOn", [])
+    return [value] if isinstance(value, str) else list(value)
+
+
+def needs_sharding(template, max_resources=MAX_RESOURCES, max_bytes=MAX_BYTES, body=None):
+    body = body if body is not None else dumps(template)
+    return len(template.get("Resources", {})) > max_resources or len(body) > max_bytes
+
+
+def components(resources):
+    """Groups logical IDs that reference each other (directly or not), in order of first appearance."""
+    parent = dict((name, name) for name in resources)
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for name, resource in resources.items():
+        for other in references(resource) | set(depends_on(resource)):
+            if other in parent:
+                parent[find(name)] = find(other)
+
+    groups = {}
+    for name in resources:
+        groups.setdefault(find(name), []).append(name)
+    return list(groups.values())
+
+
+def topological(names, resources):
+    """Orders a group so every resource comes after the ones it references."""
+    members = set(names)
+    ordered = []
+    done = set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in path:
+            raise ValueError("circular reference through " + name)
+        path.add(name)
+        for other in sorted(references(resources[name]) | set(depends_on(resources[name]))):
+            if other in members:
+                visit(other, path)
+        path.discard(name)
+        done.add(name)
+        ordered.append(name)
+
+    for name in names:
+        visit(name, set())
+    return ordered
+
+
+def chunks(names, resources, max_resources, max_bytes):
+    """Splits a list of logical IDs into runs that fit the resource and size budget."""
+    current = []
+    size = 0
+    for name in names:
+        resource_size = len(dumps(resources[name]))
+        if current and (len(current) >= max_resources or size + resource_size > max_bytes):
+            yield current
+            current = []
+            size = 0
+        current.append(name)
+        size += resource_size
+    if current:
+        yield current
+
+
+def partition(resources, max_resources, max_bytes):
+    """Returns a list of logical ID lists, one per child stack."""
+    max_bytes = int(max_bytes * HEADROOM)
+    shards = []
+    sizes = []
+
+    for group in components(resources):
+        size = sum(len(dumps(resources[name])) for name in group)
+        if len(group) <= max_resources and size <= max_bytes:
+            # Independent groups can go into any child with room left
+            for i, shard in enumerate(shards):
+                if len(shard) + len(group) <= max_resources and sizes[i] + size <= max_bytes:
+                    shard.extend(group)
+                    sizes[i] += size
+                    break
+            else:
+                shards.append(list(group))
+                sizes.append(size)
+            continue
+
+        # Too big to keep together, later parts only reference earlier ones
+        for chunk in chunks(topological(group, resources), resources, max_resources, max_bytes):
+            shards.append(chunk)
+            sizes.append(sum(len(dumps(resources[name])) for name in chunk))
+
+    return shards
+
+
+def export_name(resource, attribute):
+    return re.sub("[^A-Za-z0-9]", "", resource + (attribute or ""))
+
+
+def shard(template, max_resources=MAX_RESOURCES, max_bytes=MAX_BYTES):
+    """
+    Splits a template dict into child template dicts.
+
+    Returns a list of {"template": dict, "imports": {parameter: (child index, output)},
+    "depends": set of child indexes}.
+    """
+    resources = template.get("Resources", {})
+    parameters = template.get("Parameters", {})
+    outputs = template.get("Outputs", {})
+
+    groups = partition(resources, max_resources, max_bytes)
+    location = {}
+    for i, group in enumerate(groups):
+        for name in group:
+            location[name] = i
+
+    children = []
+    for i, group in enumerate(groups):
+        child = dict((key, copy.deepcopy(value)) for key, value in template.items()
+                     if key not in ("Resources", "Parameters", "Outputs"))
+        child["Description"] = "%s (part %d of %d)" % (template.get("Description", ""), i + 1, len(groups))
+        child["Parameters"] = {}
+        child["Resources"] = {}
+        child["Outputs"] = {}
+        children.append({"template": child, "imports": {}, "depends": set()})
+
+    def resolver(i):
+        child = children[i]
+
+        def resolve(name, attribute):
+            if name in parameters:
+                child["template"]["Parameters"][name] = copy.deepcopy(parameters[name])
+                return None
+            if name not in location or location[name] == i:
+                return None
+
+            # Reference into another child: export it there, import it here
+            source = location[name]
+            exported = export_name(name, attribute)
+            if exported in outputs:
+                exported += "Shard"
+            value = {"Fn::GetAtt": [name, attribute]} if attribute else {"Ref": name}
+            children[source]["template"]["Outputs"][exported] = {"Value": value}
+            child["template"]["Parameters"][exported] = {"Type": "String"}
+            child["imports"][exported] = (source, exported)
+            return exported
+
+        return resolve
+
+    for value in template.get("Conditions", {}).values():
+        for i in range(len(children)):
+            rewrite(value, resolver(i))
+
+    for name in resources:
+        i = location[name]
+        resource = rewrite(resources[name], resolver(i))
+        local = [other for other in depends_on(resource) if location.get(other, i) == i]
+        children[i]["depends"].update(location[other] for other in depends_on(resource) if location.get(other, i) != i)
+        if "DependsOn" in resource:
+            if local:
+                resource["DependsOn"] = local
+            else:
+                del resource["DependsOn"]
+        children[i]["template"]["Resources"][name] = resource
+
+    for name, output in outputs.items():
+        targets = [location[other] for other in references(output) if other in location]
+        i = max(targets) if targets else 0
+        children[i]["template"]["Outputs"][name] = rewrite(output, resolver(i))
+
+    for i, child in enumerate(children):
+        for key, limit in (("Parameters", MAX_PARAMETERS), ("Outputs", MAX_OUTPUTS)):
+            if len(child["template"][key]) > limit:
+                raise ValueError("part %d has %d %s, the limit is %d" % (
+                    i + 1, len(child["template"][key]), key.lower(), limit))
+        for key in ("Parameters", "Outputs"):
+            if not child["template"][key]:
+                del child["template"][key]
+
+    return children
+
+
+def shard_name(name, i):
+    return "%s-%d" % (name, i + 1)
+
+
+def wire_parent(parent, name, children):
+    """
+    Replaces the Stack resource in parent that deploys <name>.cfn with one Stack per child.
+
+    The stack is found through its TemplateURL parameter, whose default ends in /<name>.cfn.
+    Returns False when the parent has no such stack.
+    """
+    resources = parent["Resources"]
+    parameters = parent.get("Parameters", {})
+
+    for stack_id, stack in list(resources.items()):
+        if stack.get("Type") != "AWS::CloudFormation::Stack":
+            continue
+        url = stack["Properties"].get("TemplateURL", {})
+        url_parameter = url.get("Ref") if isinstance(url, dict) else None
+        if url_parameter and parameters.get(url_parameter, {}).get("Default", "").endswith("/" + name + ".cfn"):
+            break
+    else:
+        return False
+
+    stack_ids = [stack_id + str(i + 1) for i in range(len(children))]
+    output_location = {}
+    for i, child in enumerate(children):
+        for output in child["template"].get("Outputs", {}):
+            output_location[output] = i
+
+    url_default = parameters[url_parameter]["Default"]
+    del parameters[url_parameter]
+    del resources[stack_id]
+
+    for i, child in enumerate(children):
+        child_parameter = url_parameter + str(i + 1)
+        parameters[child_parameter] = dict(
+            Type="String",
+            Description="S3 url of part %d of the %s template" % (i + 1, name),
+            Default=url_default[:-len(name + ".cfn")] + shard_name(name, i) + ".cfn",
+        )
+
+        child_stack = copy.deepcopy(stack)
+        properties = child_stack["Properties"]
+        properties["TemplateURL"] = {"Ref": child_parameter}
+        properties["Parameters"] = {}
+        for parameter in child["template"].get("Parameters", {}):
+            if parameter in child["imports"]:
+                source, output = child["imports"][parameter]
+                properties["Parameters"][parameter] = {"Fn::GetAtt": [stack_ids[source], "Outputs." + output]}
+            elif parameter in stack["Properties"].get("Parameters", {}):
+                properties["Parameters"][parameter] = copy.deepcopy(stack["Properties"]["Parameters"][parameter])
+        if not properties["Parameters"]:
+            del properties["Parameters"]
+
+        depends = depends_on(stack) + [stack_ids[j] for j in sorted(child["depends"])]
+        if depends:
+            child_stack["DependsOn"] = depends
+        resources[stack_ids[i]] = child_stack
+
+    # Point everything that used the old stack at the child holding the output
+    def retarget(value):
+        if isinstance(value, dict):
+            if len(value) == 1 and "Fn::GetAtt" in value:
+                target = value["Fn::GetAtt"]
+                resource, attribute = target if isinstance(target, list) else target.split(".", 1)
+                if resource == stack_id:
+                    output = attribute[len("Outputs."):] if attribute.startswith("Outputs.") else None
+                    child_id = stack_ids[output_location[output]] if output in output_location else stack_ids[0]
+                    return {"Fn::GetAtt": [child_id, attribute]}
+            if len(value) == 1 and "Ref" in value and value["Ref"] == stack_id:
+                return {"Ref": stack_ids[0]}
+            return dict((key, retarget(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [retarget(item) for item in value]
+        return value
+
+    for key in ("Resources", "Outputs"):
+        for logical_id, value in list(parent.get(key, {}).items()):
+            value = retarget(value)
+            if key == "Resources" and stack_id in depends_on(value):
+                others = [other for other in depends_on(value) if other != stack_id]
+                value["DependsOn"] = others + stack_ids
+            parent[key][logical_id] = value
+
+    return True
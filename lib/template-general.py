@@ -4,31 +4,33 @@
 #
 import sys
 import os
-import json
-import yaml
-import troposphere
-import subprocess
-from troposphere import Base64, FindInMap, GetAtt, Join, Sub, Output, Export
-from troposphere import Parameter, Ref, Tags, Template, Export, Not, Equals
+import profiling
+profiling.start(__name__)
+
+from troposphere import GetAtt, Join, Sub, Output, Export
+from troposphere import Parameter, Ref, Tags, Template
 from troposphere.iam import Role, Policy, InstanceProfile
 from troposphere.ec2 import VPCGatewayAttachment, InternetGateway, VPC
 from troposphere.codedeploy import (
     Application,
     AutoRollbackConfiguration,
+    DeploymentConfig,
     DeploymentGroup,
     DeploymentStyle,
     Ec2TagFilters,
     Ec2TagSet,
     Ec2TagSetListObject,
-    ElbInfoList,
-    LoadBalancerInfo,
-    OnPremisesInstanceTagFilters,
+    MinimumHealthyHosts,
 )
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
 from config import *
+import topology
+
+profiling.phase("construct")
 
-from pprint import pprint
+layout = topology.load()
+role_records = layout.role_records(roles, rolemap)
 
 t = Template()
 t.add_description("Network general stack")
@@ -177,12 +179,37 @@ application = t.add_resource(Application(
     ComputePlatform="Server"
 ))
 
+# Rollout strategies CodeDeploy has a built in deployment config for
+DEPLOYMENT_STRATEGIES = {
+    "one-at-a-time": "CodeDeployDefault.OneAtATime",
+    "half-at-a-time": "CodeDeployDefault.HalfAtATime",
+    "all-at-once": "CodeDeployDefault.AllAtOnce",
+}
+
+
+def deployment_config(role):
+    """DeploymentConfigName for the role's group, None keeps CodeDeploy's default of one at a time."""
+    deployment = role.settings.get("deployment")
+    if not deployment:
+        return None
+    if "strategy" in deployment:
+        return DEPLOYMENT_STRATEGIES[deployment["strategy"]]
+
+    # "75%" keeps that share of the fleet healthy, a number that many hosts
+    minimum = deployment["minimum_healthy"]
+    if isinstance(minimum, str) and minimum.endswith("%"):
+        hosts = MinimumHealthyHosts(Type="FLEET_PERCENT", Value=int(minimum[:-1]))
+    else:
+        hosts = MinimumHealthyHosts(Type="HOST_COUNT", Value=int(minimum))
+    return Ref(t.add_resource(DeploymentConfig(role.deployment_config_id, MinimumHealthyHosts=hosts)))
+
+
 deployment_groups = {}
 
-for role in roles:
-    deployment_groups[role] = DeploymentGroup(
-        stackName + role + "DeploymentGroup",
-        DeploymentGroupName=role.capitalize(),
+for role in role_records:
+    deployment_groups[role.name] = DeploymentGroup(
+        role.deployment_group_id,
+        DeploymentGroupName=role.name.capitalize(),
         ApplicationName=stackName,
         DependsOn=application,
         AutoRollbackConfiguration=AutoRollbackConfiguration(
@@ -200,14 +227,17 @@ for role in roles:
                         Ec2TagFilters(
                             Key="Role",
                             Type="KEY_AND_VALUE",
-                            Value=role
+                            Value=role.name
                         ),
                     ]
                 )
             ]
         )
     )
-    t.add_resource(deployment_groups[role])
+    config_name = deployment_config(role)
+    if config_name:
+        deployment_groups[role.name].DeploymentConfigName = config_name
+    t.add_resource(deployment_groups[role.name])
 
 """
 Cloudformation
@@ -251,4 +281,5 @@ t.add_output(
         Value=Ref(codedeploy_instance_profile)
     ))
 
-print(t.to_json())
+if __name__ == "__main__":
+    profiling.output(t)
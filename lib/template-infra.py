@@ -4,28 +4,25 @@
 #
 import sys
 import os
-import json
-import yaml
-import troposphere
-import subprocess
-from troposphere import Base64, FindInMap, GetAtt, Join, Sub, Output, Export
-from troposphere import Parameter, Ref, Tags, Template, Export, Not, Equals, Split
+import profiling
+profiling.start(__name__)
+
+from troposphere import Base64, GetAtt, Join, Output, Export, Sub
+from troposphere import Parameter, Ref, Tags, Template, Split, Select
 from troposphere.ec2 import SecurityGroup, SecurityGroupIngress, BlockDeviceMapping, EBSBlockDevice
 from troposphere.autoscaling import LaunchConfiguration, AutoScalingGroup, Tag
-from troposphere.elasticloadbalancing import LoadBalancer, ConnectionDrainingPolicy, HealthCheck, Listener
-from troposphere.elasticloadbalancingv2 import ListenerRule, Action, Condition, TargetGroup, Matcher, TargetGroupAttribute
-from troposphere.elasticloadbalancingv2 import Listener as ListenerALB
-from troposphere.elasticloadbalancingv2 import LoadBalancer as LoadBalancerALB
-from troposphere.elasticloadbalancingv2 import Certificate as CertificateALB
-from troposphere.elasticache import CacheCluster
-from troposphere.elasticache import SecurityGroup as CacheSecurityGroup
-from troposphere.elasticache import SecurityGroupIngress as CacheSecurityGroupIngress
-from troposphere.efs import FileSystem, MountTarget
-from pprint import pprint
+from troposphere.autoscaling import ScalingPolicy, ScheduledAction, StepAdjustments
+from troposphere.autoscaling import TargetTrackingConfiguration, PredefinedMetricSpecification
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
 
 from config import *
+import topology
+
+profiling.phase("construct")
+
+layout = topology.load()
+role_records = layout.role_records(roles, rolemap)
 
 t = Template()
 t.add_description("Infrastructure nested stack")
@@ -67,12 +64,12 @@ t.add_parameter(
         Description="Iam role for codedeploy"
     ))
 
-for prefix in public_prefixes:
+for prefix in layout.prefixes.values():
     t.add_parameter(
         Parameter(
-            "pubsub" + prefix.upper(),
+            prefix.parameter,
             Type="String",
-            Description="Public subnets for " + prefix.upper()
+            Description="Public subnets for " + prefix.name.upper()
         ))
 
 # Parameters from network stack
@@ -144,40 +141,671 @@ elbSecurityGroup = t.add_resource(SecurityGroup(
 # Microservices start here
 #
 
-# roles and roleconfig come from config
-for role in roles:
-    # Dont name this resource since named resources need full stack destroy.
-    launchConfig = t.add_resource(LaunchConfiguration(
-        "launchconfig" + role.upper(),
-        ImageId=rolemap[role]["instance"]["ami"],
-        SecurityGroups=[Ref("defaultSG"), Ref(serverSecurityGroup)],
-        InstanceType=rolemap[role]["instance"]["type"],
-        IamInstanceProfile=Ref("iamCodeDeploy"),
-        AssociatePublicIpAddress=True,
-        KeyName=Ref("keyName"),
-        BlockDeviceMappings=[BlockDeviceMapping(DeviceName="/dev/xvda", Ebs=EBSBlockDevice(DeleteOnTermination=True, VolumeType="gp2", VolumeSize=10))],
-        UserData=Base64(Join('', [
-            '#!/bin/bash\n',
-            'sudo apt-get install wget\n',
-            'wget https://aws-codedeploy-',
-            awsRegion,
-            '.s3.amazonaws.com/latest/install\n',
-            'chmod +x ./install\n',
-            'sudo ./install auto\n',
-        ]))
+# target_tracking metric names and the predefined metric they track
+TRACKED_METRICS = {
+    "cpu": "ASGAverageCPUUtilization",
+    "network_in": "ASGAverageNetworkIn",
+    "network_out": "ASGAverageNetworkOut",
+    "requests": "ALBRequestCountPerTarget",
+}
+
+
+def add_scaling(role, group):
+    """Scaling policies, scheduled actions and the warm pool from the role's autoscaling settings."""
+    autoscaling = role.settings["autoscaling"]
+
+    # {"metric": "cpu", "target": 50}, "requests" (ALB roles) tracks the target group unless "resource_label" is set
+    for policy in autoscaling.get("target_tracking", []):
+        metric = PredefinedMetricSpecification(PredefinedMetricType=TRACKED_METRICS[policy["metric"]])
+        if "resource_label" in policy:
+            metric.ResourceLabel = policy["resource_label"]
+        elif policy["metric"] == "requests" and role.settings.get("elb", {}).get("type") == "alb":
+            metric.ResourceLabel = Join("/", [GetAtt(alb_id(alb_name(role)), "LoadBalancerFullName"),
+                                              GetAtt(role.target_group_id, "TargetGroupFullName")])
+        tracking = ScalingPolicy(
+            "scaletarget" + role.key + policy["metric"].replace("_", "").upper(),
+            AutoScalingGroupName=Ref(group),
+            PolicyType="TargetTrackingScaling",
+            EstimatedInstanceWarmup=policy.get("warmup", 300),
+            TargetTrackingConfiguration=TargetTrackingConfiguration(
+                PredefinedMetricSpecification=metric,
+                TargetValue=float(policy["target"])
+            )
+        )
+        if "disable_scale_in" in policy:
+            tracking.TargetTrackingConfiguration.DisableScaleIn = policy["disable_scale_in"]
+        if policy["metric"] == "requests" and "resource_label" not in policy:
+            # AWS refuses the policy until a listener or rule forwards to the target group
+            rules = role.settings["elb"].get("rules")
+            pairs = topology.rule_pairs(rules) if rules else []
+            tracking.DependsOn = [alb_listener_id(alb_name(role))] + [alb_rule_id(role, i) for i in range(len(pairs))]
+        t.add_resource(tracking)
+
+    # {"metric": "CPUUtilization", "threshold": 80, "steps": [{"lower": 0, "upper": 20, "change": 1}, ...]}
+    # "statistic" is the alarm's CloudWatch statistic, "aggregation" how the policy aggregates the metric
+    for i, policy in enumerate(autoscaling.get("step", [])):
+        # Only loaded when some role actually has a step policy
+        from troposphere.cloudwatch import Alarm, MetricDimension
+
+        steps = []
+        for step in policy["steps"]:
+            adjustment = StepAdjustments(ScalingAdjustment=step["change"])
+            if "lower" in step:
+                adjustment.MetricIntervalLowerBound = step["lower"]
+            if "upper" in step:
+                adjustment.MetricIntervalUpperBound = step["upper"]
+            steps.append(adjustment)
+
+        scaling = t.add_resource(ScalingPolicy(
+            "scalestep" + role.key + str(i),
+            AutoScalingGroupName=Ref(group),
+            PolicyType="StepScaling",
+            AdjustmentType=policy.get("adjustment", "ChangeInCapacity"),
+            MetricAggregationType=policy.get("aggregation", "Average"),
+            EstimatedInstanceWarmup=policy.get("warmup", 300),
+            StepAdjustments=steps
+        ))
+        t.add_resource(Alarm(
+            "scalestepalarm" + role.key + str(i),
+            AlarmDescription="Step scaling of " + role.name + " on " + policy["metric"],
+            Namespace=policy.get("namespace", "AWS/EC2"),
+            MetricName=policy["metric"],
+            Dimensions=[MetricDimension(Name="AutoScalingGroupName", Value=Ref(group))],
+            Statistic=policy.get("statistic", "Average"),
+            Period=policy.get("period", 60),
+            EvaluationPeriods=policy.get("evaluation_periods", 2),
+            Threshold=policy["threshold"],
+            ComparisonOperator=policy.get("comparison", "GreaterThanOrEqualToThreshold"),
+            AlarmActions=[Ref(scaling)]
+        ))
+
+    # {"name": "weekdays", "recurrence": "0 7 * * 1-5", "min": 2, "max": 6, "desired": 3}
+    for action in autoscaling.get("scheduled", []):
+        scheduled = ScheduledAction(
+            "schedule" + role.key + action["name"].upper(),
+            AutoScalingGroupName=Ref(group),
+            Recurrence=action["recurrence"]
+        )
+        for key, prop in (("min", "MinSize"), ("max", "MaxSize"), ("desired", "DesiredCapacity")):
+            if key in action:
+                setattr(scheduled, prop, action[key])
+        t.add_resource(scheduled)
+
+    # {"min": 1, "max_prepared": 4, "state": "Stopped"}, instances initialized ahead of scale out
+    if "warm_pool" in autoscaling:
+        from resources import WarmPool, InstanceReusePolicy
+
+        warm_pool = autoscaling["warm_pool"]
+        pool = WarmPool(
+            "warmpool" + role.key,
+            AutoScalingGroupName=Ref(group),
+            MinSize=warm_pool.get("min", 0),
+            PoolState=warm_pool.get("state", "Stopped")
+        )
+        if "max_prepared" in warm_pool:
+            pool.MaxGroupPreparedCapacity = warm_pool["max_prepared"]
+        if "reuse_on_scale_in" in warm_pool:
+            pool.InstanceReusePolicy = InstanceReusePolicy(ReuseOnScaleIn=warm_pool["reuse_on_scale_in"])
+        t.add_resource(pool)
+
+
+def alb_name(role):
+    """Roles naming the same "alb" share one load balancer, the others get one of their own."""
+    return role.settings["elb"].get("alb", role.name)
+
+
+def alb_id(name):
+    return "alb" + name.upper()
+
+
+def alb_listener_id(name):
+    """The listener forwarding to the ALB's target groups, HTTPS when its first role has a certificate."""
+    return alb_id(name) + ("HTTPS" if "https" in albs[name][0].settings["elb"] else "HTTP")
+
+
+def alb_rule_id(role, i):
+    return "albrule" + role.key + str(i)
+
+
+def health_path(healthcheck):
+    """Path of a Classic ELB style "HTTP:80/health" target, or a plain "/health"."""
+    return "/" + healthcheck.split("/", 1)[1] if "/" in healthcheck else "/"
+
+
+def add_target_group(role):
+    from troposphere.elasticloadbalancingv2 import TargetGroup, TargetGroupAttribute, Matcher
+
+    elb = role.settings["elb"]
+    delay = elb.get("deregistration_delay", 300)
+    attributes = [TargetGroupAttribute(Key="deregistration_delay.timeout_seconds", Value=str(delay))]
+    if "slow_start" in elb:
+        attributes.append(TargetGroupAttribute(Key="slow_start.duration_seconds", Value=str(elb["slow_start"])))
+    if "algorithm" in elb:
+        # round_robin or least_outstanding_requests
+        attributes.append(TargetGroupAttribute(Key="load_balancing.algorithm.type", Value=elb["algorithm"]))
+
+    return t.add_resource(TargetGroup(
+        role.target_group_id,
+        Port=80,
+        Protocol="HTTP",
+        VpcId=Ref("vpcId"),
+        HealthCheckPath=health_path(elb["healthcheck"]),
+        HealthyThresholdCount=2,
+        UnhealthyThresholdCount=2,
+        HealthCheckIntervalSeconds=10,
+        HealthCheckTimeoutSeconds=5,
+        Matcher=Matcher(HttpCode="200"),
+        TargetGroupAttributes=attributes,
+        Tags=Tags(
+            Environment=Ref("environment"),
+            Service=role.name
+        )
+    ))
+
+
+def add_alb(name, members, priorities):
+    """One ALB for the member roles: roles without "rules" take the default action, the rest path/host rules."""
+    from troposphere.elasticloadbalancingv2 import LoadBalancer as LoadBalancerALB, Listener as ListenerALB
+    from troposphere.elasticloadbalancingv2 import ListenerRule, Action, Certificate, Condition
+    from troposphere.elasticloadbalancingv2 import LoadBalancerAttributes, RedirectConfig, FixedResponseConfig
+
+    # Subnets, certificate and attributes come from the first role on the ALB, export.py checks the others match
+    elb = members[0].settings["elb"]
+    alb = t.add_resource(LoadBalancerALB(
+        alb_id(name),
+        Type="application",
+        Scheme="internet-facing",
+        Subnets=Split(",", Ref(members[0].elb_parameter)),
+        SecurityGroups=[Ref("defaultSG"), Ref(elbSecurityGroup)],
+        LoadBalancerAttributes=[
+            LoadBalancerAttributes(Key="routing.http2.enabled", Value=str(elb.get("http2", True)).lower()),
+            LoadBalancerAttributes(Key="idle_timeout.timeout_seconds", Value=str(elb.get("idle_timeout", 60))),
+        ],
+        Tags=Tags(
+            Environment=Ref("environment"),
+            Service=name
+        )
     ))
 
+    default = [role for role in members if "rules" not in role.settings["elb"]]
+    if default:
+        default_action = Action(Type="forward", TargetGroupArn=Ref(default[0].target_group_id))
+    else:
+        default_action = Action(Type="fixed-response", FixedResponseConfig=FixedResponseConfig(
+            StatusCode="404", ContentType="text/plain", MessageBody="Not found"))
+
+    if "https" in elb:
+        listener = t.add_resource(ListenerALB(
+            alb_listener_id(name),
+            LoadBalancerArn=Ref(alb),
+            Port=443,
+            Protocol="HTTPS",
+            Certificates=[Certificate(CertificateArn=elb["https"]["certificate"])],
+            SslPolicy=elb["https"].get("ssl_policy", "ELBSecurityPolicy-TLS-1-2-2017-01"),
+            DefaultActions=[default_action]
+        ))
+        t.add_resource(ListenerALB(
+            alb_id(name) + "HTTP",
+            LoadBalancerArn=Ref(alb),
+            Port=80,
+            Protocol="HTTP",
+            DefaultActions=[Action(Type="redirect", RedirectConfig=RedirectConfig(
+                Protocol="HTTPS", Port="443", StatusCode="HTTP_301"))]
+        ))
+    else:
+        listener = t.add_resource(ListenerALB(
+            alb_listener_id(name),
+            LoadBalancerArn=Ref(alb),
+            Port=80,
+            Protocol="HTTP",
+            DefaultActions=[default_action]
+        ))
+
+    # {"paths": ["/api/*"], "hosts": ["api.example.com"], "priority": 10}, a rule per host and path pair
+    for role in members:
+        rules = role.settings["elb"].get("rules")
+        if not rules:
+            continue
+        pairs = topology.rule_pairs(rules)
+        for i, priority in enumerate(topology.rule_priorities(rules, priorities)):
+            host, path = pairs[i]
+            conditions = []
+            if host:
+                conditions.append(Condition(Field="host-header", Values=[host]))
+            if path:
+                conditions.append(Condition(Field="path-pattern", Values=[path]))
+            t.add_resource(ListenerRule(
+                alb_rule_id(role, i),
+                ListenerArn=Ref(listener),
+                Priority=priority,
+                Conditions=conditions,
+                Actions=[Action(Type="forward", TargetGroupArn=Ref(role.target_group_id))]
+            ))
+
+
+CACHE_PORTS = {
+    "redis": 6379,
+    "memcached": 11211,
+}
+
+
+def add_cache(role):
+    """The role's cache tier: subnet group on its subnets, a security group for its servers, the endpoint output."""
+    # {"engine": "redis", "node_type": "cache.t3.micro", "nodes": 2, "availability_zones": [...],
+    #  "parameter_group": "default.redis6.x" or {"family": "redis6.x", "parameters": {...}}}
+    # Several redis nodes become a replication group with failover, memcached nodes one cluster
+    from troposphere.elasticache import CacheCluster, ReplicationGroup, SubnetGroup, ParameterGroup
+
+    cache = role.settings["cache"]
+    engine = cache.get("engine", "redis")
+    port = cache.get("port", CACHE_PORTS[engine])
+    nodes = cache.get("nodes", 1)
+    zones = cache.get("availability_zones", [zone.name for zone in layout.availability_zones])
+    placement = [zones[i % len(zones)] for i in range(nodes)]
+
+    subnet_group = t.add_resource(SubnetGroup(
+        "cachesubnets" + role.key,
+        Description="Cache subnets of " + role.name,
+        SubnetIds=Split(",", Ref(role.subnet_parameter))
+    ))
+
+    security_group = t.add_resource(SecurityGroup(
+        "cachesg" + role.key,
+        VpcId=Ref("vpcId"),
+        GroupDescription="Cache of " + role.name + ", reachable from the servers only",
+        SecurityGroupIngress=[{
+            "IpProtocol": "tcp",
+            "FromPort": port,
+            "ToPort": port,
+            "SourceSecurityGroupId": Ref(serverSecurityGroup)
+        }],
+        Tags=Tags(
+            Environment=Ref("environment"),
+            Service=role.name
+        )
+    ))
+
+    settings = {
+        "CacheNodeType": cache.get("node_type", "cache.t3.micro"),
+        "Engine": engine,
+        "Port": port,
+        "CacheSubnetGroupName": Ref(subnet_group),
+    }
+    if "engine_version" in cache:
+        settings["EngineVersion"] = cache["engine_version"]
+    parameter_group = cache.get("parameter_group")
+    if isinstance(parameter_group, dict):
+        settings["CacheParameterGroupName"] = Ref(t.add_resource(ParameterGroup(
+            "cacheparams" + role.key,
+            CacheParameterGroupFamily=parameter_group["family"],
+            Description="Cache parameters of " + role.name,
+            Properties=dict((key, str(value)) for key, value in parameter_group.get("parameters", {}).items())
+        )))
+    elif parameter_group:
+        settings["CacheParameterGroupName"] = parameter_group
+
+    if engine == "redis" and nodes > 1:
+        cluster = t.add_resource(ReplicationGroup(
+            "cache" + role.key,
+            ReplicationGroupDescription="Cache of " + role.name,
+            NumCacheClusters=nodes,
+            AutomaticFailoverEnabled=True,
+            PreferredCacheClusterAZs=placement,
+            SecurityGroupIds=[Ref(security_group)],
+            **settings
+        ))
+        address, port_attribute = "PrimaryEndPoint.Address", "PrimaryEndPoint.Port"
+    else:
+        cluster = t.add_resource(CacheCluster(
+            "cache" + role.key,
+            NumCacheNodes=nodes,
+            VpcSecurityGroupIds=[Ref(security_group)],
+            **settings
+        ))
+        if engine == "redis":
+            cluster.PreferredAvailabilityZone = placement[0]
+            address, port_attribute = "RedisEndpoint.Address", "RedisEndpoint.Port"
+        else:
+            cluster.AZMode = "cross-az" if len(set(placement)) > 1 else "single-az"
+            cluster.PreferredAvailabilityZones = placement
+            address, port_attribute = "ConfigurationEndpoint.Address", "ConfigurationEndpoint.Port"
+
+    t.add_output(
+        Output(
+            stackName + role.name + "cache",
+            Description="Cache endpoint (host:port) of " + role.name,
+            Value=Join(":", [GetAtt(cluster, address), GetAtt(cluster, port_attribute)]),
+            Export=Export(Sub(stackName + role.name + "cache")),
+        ))
+
+
+def add_file_system(name, role):
+    """EFS file system with one mount target per subnet of the role, returns (file system, mount target ids)."""
+    # {"name": "assets", "mount": "/srv/shared", "performance_mode": "generalPurpose" or "maxIO",
+    #  "throughput_mode": "bursting", "provisioned" (with "throughput" MiB/s) or "elastic"}
+    from troposphere.efs import MountTarget
+    from resources import FileSystem
+
+    efs = role.settings["efs"]
+    file_system = FileSystem(
+        "efs" + name.upper(),
+        Encrypted=efs.get("encrypted", True),
+        PerformanceMode=efs.get("performance_mode", "generalPurpose"),
+        ThroughputMode=efs.get("throughput_mode", "bursting"),
+        FileSystemTags=Tags(
+            Name=Join("-", [Ref("stackName"), name]),
+            Environment=Ref("environment")
+        )
+    )
+    if file_system.ThroughputMode == "provisioned":
+        file_system.ProvisionedThroughputInMibps = float(efs["throughput"])
+    t.add_resource(file_system)
+
+    security_group = t.add_resource(SecurityGroup(
+        "efssg" + name.upper(),
+        VpcId=Ref("vpcId"),
+        GroupDescription="NFS to the " + name + " file system from the servers only",
+        SecurityGroupIngress=[{
+            "IpProtocol": "tcp",
+            "FromPort": 2049,
+            "ToPort": 2049,
+            "SourceSecurityGroupId": Ref(serverSecurityGroup)
+        }],
+        Tags=Tags(
+            Environment=Ref("environment")
+        )
+    ))
+
+    # One mount target per availability zone serves every subnet in it
+    mount_targets = []
+    subnets = layout.prefixes[role.settings["instance"]["subnet"]].subnets
+    for i, subnet in enumerate(subnets):
+        mount_targets.append(t.add_resource(MountTarget(
+            "efsmount" + name.upper() + subnet.availability_zone.key,
+            FileSystemId=Ref(file_system),
+            SubnetId=Select(i, Split(",", Ref(role.subnet_parameter))),
+            SecurityGroups=[Ref(security_group)]
+        )).title)
+
+    t.add_output(
+        Output(
+            stackName + name + "efs",
+            Description="EFS file system id of " + name,
+            Value=Ref(file_system),
+            Export=Export(Sub(stackName + name + "efs")),
+        ))
+    return file_system, mount_targets
+
+
+def mount_file_system(file_system, path):
+    """UserData lines mounting the file system at path, retried while its DNS name propagates."""
+    return [
+        'apt-get install -y nfs-common\n',
+        'mkdir -p ' + path + '\n',
+        'echo "', Ref(file_system), '.efs.', awsRegion, '.amazonaws.com:/ ', path,
+        ' nfs4 nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2,noresvport,_netdev 0 0"',
+        ' >> /etc/fstab\n',
+        'for i in $(seq 1 30); do mount ' + path + ' && break; sleep 10; done\n',
+    ]
+
+
+ALL_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "POST", "PATCH", "DELETE"]
+READ_METHODS = ["GET", "HEAD"]
+
+
+def cache_behavior(cls, origin, behavior, forward_host=False, **extra):
+    """A cache behavior for the origin; the defaults forward everything and let origin Cache-Control decide."""
+    from troposphere.cloudfront import ForwardedValues, Cookies
+
+    # "all", "none" or a list of cookie names
+    cookies = behavior.get("cookies", "all")
+    if isinstance(cookies, list):
+        cookies = Cookies(Forward="whitelist", WhitelistedNames=cookies)
+    else:
+        cookies = Cookies(Forward=cookies)
+    forwarded = ForwardedValues(QueryString=behavior.get("query_string", True), Cookies=cookies)
+    headers = behavior.get("headers", [])
+    if forward_host and "*" not in headers and "Host" not in headers:
+        headers = headers + ["Host"]
+    if headers:
+        forwarded.Headers = headers
+
+    return cls(
+        TargetOriginId=origin,
+        ViewerProtocolPolicy=behavior.get("viewer_protocol", "redirect-to-https"),
+        AllowedMethods=READ_METHODS if behavior.get("read_only") else ALL_METHODS,
+        CachedMethods=READ_METHODS,
+        ForwardedValues=forwarded,
+        Compress=behavior.get("compress", True),
+        MinTTL=behavior.get("min_ttl", 0),
+        DefaultTTL=behavior.get("default_ttl", 0),
+        MaxTTL=behavior.get("max_ttl", 31536000),
+        **extra
+    )
+
+
+def add_distribution(role):
+    """CloudFront distribution with the role's load balancer as origin, its domain exported."""
+    # {"aliases": ["www.example.com"], "certificate": "arn:aws:acm:us-east-1:...", "price_class": "PriceClass_100",
+    #  "origin_protocol": "https-only", "keepalive": 5, "read_timeout": 30, "default_ttl": 0, "compress": True,
+    #  "behaviors": [{"path": "/static/*", "default_ttl": 86400, "query_string": False, "cookies": "none",
+    #                 "read_only": True}]}
+    from troposphere.cloudfront import Distribution, DistributionConfig, Origin, CustomOriginConfig
+    from troposphere.cloudfront import DefaultCacheBehavior, CacheBehavior, ViewerCertificate
+
+    cdn = role.settings["cdn"]
+    elb = role.settings["elb"]
+    if elb.get("type") == "alb":
+        domain = GetAtt(alb_id(alb_name(role)), "DNSName")
+        # An ALB with a certificate redirects port 80 to https, which would send viewers past the distribution
+        https = "https" in albs[alb_name(role)][0].settings["elb"]
+        # A host routed role is only reached with its Host, the ALB's default role gets everything else
+        forward_host = "hosts" in elb.get("rules", {})
+    else:
+        domain = GetAtt(role.elb_id, "DNSName")
+        https = forward_host = False
+    origin = "origin" + role.key
+
+    config = DistributionConfig(
+        Comment=Join(" ", [Ref("stackName"), role.name]),
+        Enabled=True,
+        HttpVersion="http2",
+        IPV6Enabled=True,
+        PriceClass=cdn.get("price_class", "PriceClass_All"),
+        Origins=[Origin(
+            Id=origin,
+            DomainName=domain,
+            CustomOriginConfig=CustomOriginConfig(
+                OriginProtocolPolicy=cdn.get("origin_protocol", "https-only" if https else "http-only"),
+                OriginKeepaliveTimeout=cdn.get("keepalive", 5),
+                OriginReadTimeout=cdn.get("read_timeout", 30),
+                OriginSSLProtocols=["TLSv1.2"]
+            )
+        )],
+        DefaultCacheBehavior=cache_behavior(DefaultCacheBehavior, origin, cdn, forward_host)
+    )
+    # {"path": "/static/*", ...} with the same settings as the default behavior, first match wins
+    if cdn.get("behaviors"):
+        config.CacheBehaviors = [cache_behavior(CacheBehavior, origin, behavior, forward_host,
+                                                PathPattern=behavior["path"])
+                                 for behavior in cdn["behaviors"]]
+    if "certificate" in cdn:
+        config.Aliases = cdn.get("aliases", [])
+        config.ViewerCertificate = ViewerCertificate(
+            AcmCertificateArn=cdn["certificate"],
+            SslSupportMethod="sni-only",
+            MinimumProtocolVersion=cdn.get("minimum_protocol", "TLSv1.2_2018")
+        )
+    else:
+        config.ViewerCertificate = ViewerCertificate(CloudFrontDefaultCertificate=True)
+
+    distribution = t.add_resource(Distribution(
+        "cdn" + role.key,
+        DistributionConfig=config,
+        Tags=Tags(
+            Environment=Ref("environment"),
+            Service=role.name
+        )
+    ))
+
+    t.add_output(
+        Output(
+            stackName + role.name + "cdn",
+            Description="CloudFront domain of " + role.name,
+            Value=GetAtt(distribution, "DomainName"),
+            Export=Export(Sub(stackName + role.name + "cdn")),
+        ))
+
+
+# Launch template settings that make the group mix in spot instances
+SPOT_SETTINGS = ["on_demand_base", "on_demand_percentage", "spot_allocation", "spot_max_price"]
+
+
+def add_launch_template(role, user_data):
+    """Launch template for the role, returns the AutoScalingGroup properties that launch instances from it."""
+    # {"root_volume": {"size": 20, "type": "gp3", "iops": 3000, "throughput": 125},
+    #  "volumes": [{"device": "/dev/xvdf", "size": 100, "iops": 6000, "throughput": 250}],
+    #  "ebs_optimized": True, "placement_group": "spread" or "cluster",
+    #  "instance_types": ["t3.large", "t3a.large"], "on_demand_base": 1, "on_demand_percentage": 25,
+    #  "spot_allocation": "capacity-optimized", "spot_max_price": "0.05"}
+    from troposphere.ec2 import LaunchTemplate, LaunchTemplateData, NetworkInterfaces, PlacementGroup
+    from troposphere.autoscaling import LaunchTemplate as MixedLaunchTemplate, LaunchTemplateSpecification
+    from troposphere.autoscaling import LaunchTemplateOverrides, MixedInstancesPolicy, InstancesDistribution
+    from resources import EBSBlockDevice, IamInstanceProfile
+
+    instance = role.settings["instance"]
+    settings = role.settings["launch_template"]
+
+    # The root volume keeps the LaunchConfiguration's device and size unless configured
+    volumes = [dict({"device": "/dev/xvda", "size": 10}, **settings.get("root_volume", {}))]
+    mappings = []
+    for volume in volumes + settings.get("volumes", []):
+        ebs = EBSBlockDevice(
+            DeleteOnTermination=volume.get("delete_on_termination", True),
+            VolumeType=volume.get("type", "gp3"),
+            VolumeSize=volume["size"]
+        )
+        for key, prop in (("iops", "Iops"), ("throughput", "Throughput"), ("encrypted", "Encrypted"),
+                          ("kms_key", "KmsKeyId"), ("snapshot", "SnapshotId")):
+            if key in volume:
+                setattr(ebs, prop, volume[key])
+        mappings.append(BlockDeviceMapping(DeviceName=volume["device"], Ebs=ebs))
+
+    data = LaunchTemplateData(
+        ImageId=instance["ami"],
+        InstanceType=instance["type"],
+        IamInstanceProfile=IamInstanceProfile(Name=Ref("iamCodeDeploy")),
+        KeyName=Ref("keyName"),
+        NetworkInterfaces=[NetworkInterfaces(
+            DeviceIndex=0,
+            AssociatePublicIpAddress=True,
+            DeleteOnTermination=True,
+            Groups=[Ref("defaultSG"), Ref(serverSecurityGroup)]
+        )],
+        BlockDeviceMappings=mappings,
+        UserData=Base64(Join('', user_data))
+    )
+    if "ebs_optimized" in settings:
+        data.EbsOptimized = settings["ebs_optimized"]
+
+    # Dont name this resource since named resources need full stack destroy.
+    template = t.add_resource(LaunchTemplate(role.launch_template_id, LaunchTemplateData=data))
+    specification = LaunchTemplateSpecification(
+        LaunchTemplateId=Ref(template),
+        Version=GetAtt(template, "LatestVersionNumber")
+    )
+
+    launch = {}
+    if "placement_group" in settings:
+        launch["PlacementGroup"] = Ref(t.add_resource(PlacementGroup(
+            "placement" + role.key,
+            Strategy=settings["placement_group"]
+        )))
+
+    if "instance_types" not in settings and not any(key in settings for key in SPOT_SETTINGS):
+        launch["LaunchTemplate"] = specification
+        return launch
+
+    # Instance types are tried in order, capacity above the on-demand base is split with spot
+    distribution = InstancesDistribution(
+        OnDemandBaseCapacity=settings.get("on_demand_base", 0),
+        OnDemandPercentageAboveBaseCapacity=settings.get("on_demand_percentage", 100),
+        SpotAllocationStrategy=settings.get("spot_allocation", "capacity-optimized")
+    )
+    if "spot_max_price" in settings:
+        distribution.SpotMaxPrice = str(settings["spot_max_price"])
+    launch["MixedInstancesPolicy"] = MixedInstancesPolicy(
+        InstancesDistribution=distribution,
+        LaunchTemplate=MixedLaunchTemplate(
+            LaunchTemplateSpecification=specification,
+            Overrides=[LaunchTemplateOverrides(InstanceType=instance_type)
+                       for instance_type in settings.get("instance_types", [instance["type"]])]
+        )
+    )
+    return launch
+
+
+# Roles naming the same "alb" share it, in role order
+albs = {}
+for role in role_records:
+    if role.settings.get("elb", {}).get("type") == "alb":
+        albs.setdefault(alb_name(role), []).append(role)
+
+# Roles naming the same efs "name" share one file system
+file_systems = {}
+for role in role_records:
+    if "efs" in role.settings:
+        name = role.settings["efs"].get("name", role.name)
+        if name not in file_systems:
+            file_systems[name] = add_file_system(name, role)
+
+# role_records come from the shared topology, roleconfig is their rolemap entry
+for role in role_records:
+    roleconfig = role.settings
+
+    user_data = [
+        '#!/bin/bash\n',
+        'sudo apt-get install wget\n',
+        'wget https://aws-codedeploy-',
+        awsRegion,
+        '.s3.amazonaws.com/latest/install\n',
+        'chmod +x ./install\n',
+        'sudo ./install auto\n',
+    ]
+    mount_targets = []
+    if "efs" in roleconfig:
+        file_system, mount_targets = file_systems[roleconfig["efs"].get("name", role.name)]
+        user_data += mount_file_system(file_system, roleconfig["efs"].get("mount", "/srv/shared"))
+
+    if "launch_template" in roleconfig:
+        launch = add_launch_template(role, user_data)
+    else:
+        # Dont name this resource since named resources need full stack destroy.
+        launchConfig = t.add_resource(LaunchConfiguration(
+            role.launch_config_id,
+            ImageId=roleconfig["instance"]["ami"],
+            SecurityGroups=[Ref("defaultSG"), Ref(serverSecurityGroup)],
+            InstanceType=roleconfig["instance"]["type"],
+            IamInstanceProfile=Ref("iamCodeDeploy"),
+            AssociatePublicIpAddress=True,
+            KeyName=Ref("keyName"),
+            BlockDeviceMappings=[BlockDeviceMapping(DeviceName="/dev/xvda", Ebs=EBSBlockDevice(DeleteOnTermination=True, VolumeType="gp2", VolumeSize=10))],
+            UserData=Base64(Join('', user_data))
+        ))
+        launch = {"LaunchConfigurationName": Ref(launchConfig)}
+
     loadbalancer = []
     targetgroup = []
 
-    if "elb" in rolemap[role]:
-        elb_identifier = ""
-        if rolemap[role]["elb"]["subnet"] in public_prefixes:
-            elb_identifier = "pubsub" + rolemap[role]["elb"]["subnet"].upper()
+    if roleconfig.get("elb", {}).get("type") == "alb":
+        targetgroup = [Ref(add_target_group(role))]
+    elif "elb" in roleconfig:
+        # Only loaded when some role actually gets a load balancer
+        from troposphere.elasticloadbalancing import LoadBalancer, ConnectionDrainingPolicy, HealthCheck, Listener
 
         elb = t.add_resource(LoadBalancer(
-            "elb" + role.upper(),
-            Subnets=Split(",", Ref(elb_identifier)),
+            role.elb_id,
+            Subnets=Split(",", Ref(role.elb_parameter)),
             Listeners=[
                 Listener(
                     LoadBalancerPort=80,
@@ -187,7 +815,7 @@ for role in roles:
             ],
             SecurityGroups=[Ref("defaultSG"), Ref(elbSecurityGroup)],
             HealthCheck=HealthCheck(
-                Target=rolemap[role]["elb"]["healthcheck"],
+                Target=roleconfig["elb"]["healthcheck"],
                 HealthyThreshold="2",
                 UnhealthyThreshold="2",
                 Interval="10",
@@ -200,33 +828,49 @@ for role in roles:
             CrossZone=True,
             Tags=Tags(
                 Environment=Ref("environment"),
-                Service=role
+                Service=role.name
             )
         ))
 
         loadbalancer = [Ref(elb)]
 
-    identifier = ""
-    if rolemap[role]["instance"]["subnet"] in public_prefixes:
-        identifier = "pubsub" + rolemap[role]["instance"]["subnet"].upper()
-
     # Dont name this resource since named resources need full stack destroy.
-    t.add_resource(AutoScalingGroup(
-        "autoscaling" + role.upper(),
-        VPCZoneIdentifier=Split(",", Ref(identifier)),
-        LaunchConfigurationName=Ref(launchConfig),
+    group = t.add_resource(AutoScalingGroup(
+        role.autoscaling_id,
+        VPCZoneIdentifier=Split(",", Ref(role.subnet_parameter)),
         LoadBalancerNames=loadbalancer,
         TargetGroupARNs=targetgroup,
-        MinSize=rolemap[role]["autoscaling"]["min"],
-        MaxSize=rolemap[role]["autoscaling"]["max"],
+        MinSize=roleconfig["autoscaling"]["min"],
+        MaxSize=roleconfig["autoscaling"]["max"],
         Tags=[
             Tag("Environment", Ref("environment"), "true"),
-            Tag("Name", Join("-", [Ref("stackName"), role]), "true"),
-            Tag("Service", role, "true"),
-            Tag("Role", role, "true"),
-            Tag("pp_role", rolemap[role]["instance"]["pp_role"], "true")
-        ]
+            Tag("Name", Join("-", [Ref("stackName"), role.name]), "true"),
+            Tag("Service", role.name, "true"),
+            Tag("Role", role.name, "true"),
+            Tag("pp_role", roleconfig["instance"]["pp_role"], "true")
+        ],
+        **launch
     ))
 
+    # Instances only boot once they can mount
+    if mount_targets:
+        group.DependsOn = mount_targets
+
+    add_scaling(role, group)
+
+    if "cache" in roleconfig:
+        add_cache(role)
+
+# Application load balancers, after the roles so shared ones know all their target groups
+priorities = [0]
+for name, members in albs.items():
+    add_alb(name, members, priorities)
+
+# CloudFront in front of the load balancers, once they all exist
+for role in role_records:
+    if "cdn" in role.settings:
+        add_distribution(role)
+
 
-print(t.to_json())
+if __name__ == "__main__":
+    profiling.output(t)
@@ -4,15 +4,19 @@
 #
 import sys
 import os
-import json
-import yaml
-import troposphere
+import profiling
+profiling.start(__name__)
+
 from troposphere import Parameter, Ref, Template, GetAtt
 from troposphere.cloudformation import Stack
-from pprint import pprint
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
 from config import *
+import topology
+
+profiling.phase("construct")
+
+layout = topology.load()
 
 t = Template()
 t.add_version("2010-09-09")
@@ -111,7 +115,8 @@ stack_infra = t.add_resource(
         }
     ))
 
-for prefix in public_prefixes:
-    data = t.resources["vpcinfra"].properties["Parameters"].update({"pubsub" + prefix.upper(): GetAtt("vpcnetworkpublic", "Outputs." + stackName + "pubsub" + prefix.upper())})
+for prefix in layout.prefixes.values():
+    stack_infra.properties["Parameters"][prefix.parameter] = GetAtt("vpcnetworkpublic", "Outputs." + prefix.output)
 
-print(t.to_json())
+if __name__ == "__main__":
+    profiling.output(t)
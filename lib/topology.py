@@ -0,0 +1,168 @@
+#
+# Topology shared by the generators: availability zones, public prefixes,
+# subnets, route tables and roles
+#
+# Built once from config and reused by every generator in the same process
+# (lib/build.py runs them all in one). The records use __slots__ and carry
+# their logical IDs, parameter and output names precomputed, so the
+# generators do not rebuild nested dicts or names by string concatenation.
+#
+# Only the network layout is read from config here. Generators that need the
+# roles pass them to role_records(), so the build cache fingerprints of the
+# others do not depend on the role settings.
+#
+import sys
+import json
+
+import cidr
+
+
+class AvailabilityZone(object):
+    __slots__ = ("name", "key", "subnets")
+
+    def __init__(self, name):
+        self.name = name
+        # Logical IDs only allow alphanumerics
+        self.key = name.replace("-", "")
+        self.subnets = []
+
+
+class Prefix(object):
+    """A public prefix: its subnets in availability zone order and the names they are passed around by."""
+    __slots__ = ("name", "parameter", "output", "subnets")
+
+    def __init__(self, name, stack_name):
+        self.name = name
+        self.parameter = "pubsub" + name.upper()
+        self.output = stack_name + self.parameter
+        self.subnets = []
+
+
+class RouteTable(object):
+    __slots__ = ("logical_id", "name")
+
+    def __init__(self, availability_zone, prefix):
+        self.logical_id = "pubrttable" + availability_zone.key + prefix.upper()
+        self.name = "-" + availability_zone.name + "-public-route-table-" + prefix
+
+
+class Subnet(object):
+    __slots__ = ("availability_zone", "prefix", "cidr", "logical_id", "name", "association_id", "route_id",
+                 "route_table")
+
+    def __init__(self, availability_zone, prefix, cidr_block):
+        self.availability_zone = availability_zone
+        self.prefix = prefix
+        self.cidr = cidr_block
+        suffix = availability_zone.key + prefix.upper()
+        self.logical_id = "pubsub" + suffix
+        self.name = "-" + availability_zone.name + "-public-subnet-" + prefix.upper()
+        self.association_id = "pubsubassoc" + suffix
+        self.route_id = "pubrt" + suffix
+        self.route_table = RouteTable(availability_zone, prefix)
+
+
+class Role(object):
+    __slots__ = ("name", "settings", "key", "subnet_parameter", "elb_parameter", "launch_config_id",
+                 "launch_template_id", "autoscaling_id", "elb_id", "target_group_id", "deployment_group_id",
+                 "deployment_config_id")
+
+    def __init__(self, name, settings, prefixes, stack_name):
+        self.name = name
+        self.settings = settings
+        self.key = name.upper()
+        self.launch_config_id = "launchconfig" + self.key
+        self.launch_template_id = "launchtemplate" + self.key
+        self.autoscaling_id = "autoscaling" + self.key
+        self.elb_id = "elb" + self.key
+        self.target_group_id = "targetgroup" + self.key
+        self.deployment_group_id = stack_name + name + "DeploymentGroup"
+        self.deployment_config_id = stack_name + name + "DeploymentConfig"
+        # Name of the infra stack parameter holding the role's comma separated subnets
+        self.subnet_parameter = subnet_parameter(settings["instance"]["subnet"], prefixes)
+        self.elb_parameter = subnet_parameter(settings["elb"]["subnet"], prefixes) if "elb" in settings else None
+
+
+def subnet_parameter(name, prefixes):
+    return prefixes[name].parameter if name in prefixes else ""
+
+
+def rule_pairs(rules):
+    """(host, path) of every ALB listener rule an elb "rules" entry becomes, None where it does not match on it."""
+    return [(host, path) for host in rules.get("hosts", [None]) for path in rules.get("paths", [None])]
+
+
+def rule_priorities(rules, priorities):
+    """
+    Priorities of the rule_pairs(rules), counting up from "priority".
+
+    Without one they continue after the last priority handed out, priorities
+    is the list of those (starting with [0]) and gets the new ones appended.
+    """
+    first = rules.get("priority", priorities[-1] + 1)
+    assigned = [first + i for i in range(len(rule_pairs(rules)))]
+    priorities.extend(assigned)
+    return assigned
+
+
+class Topology(object):
+    __slots__ = ("stack_name", "availability_zones", "prefixes", "subnets", "_roles")
+
+    def __init__(self, config):
+        self.stack_name = config.stackName
+        self.availability_zones = [AvailabilityZone(name) for name in config.availability_zones]
+        self.prefixes = dict((name, Prefix(name, self.stack_name)) for name in config.public_prefixes)
+
+        # cidr_map (optional) pins already deployed subnets, the rest is allocated
+        cidrs = cidr.allocate(
+            config.privateVpcCidr,
+            config.availability_zones,
+            config.public_prefixes,
+            sizes=getattr(config, "subnet_sizes", {}),
+            cidr_map=getattr(config, "cidr_map", {}),
+            max_availability_zones=cidr.zone_slots(config.all_availability_zones,
+                                                   getattr(config, "availability_zone_slots", None)),
+        )
+
+        self.subnets = []
+        for availability_zone in self.availability_zones:
+            for name in config.public_prefixes:
+                subnet = Subnet(availability_zone, name, cidrs[availability_zone.name]["public"][name])
+                availability_zone.subnets.append(subnet)
+                self.prefixes[name].subnets.append(subnet)
+                self.subnets.append(subnet)
+
+        self._roles = None
+
+    def role_records(self, names, settings):
+        """Role records of the named roles, settings maps a name to its entry; built once per set of inputs."""
+        key = json.dumps([names, settings], sort_keys=True, default=repr)
+        if self._roles is None or self._roles[0] != key:
+            self._roles = (key, [Role(name, settings[name], self.prefixes, self.stack_name) for name in names])
+        return self._roles[1]
+
+
+_cached = None
+
+
+def inputs(config):
+    return json.dumps([
+        config.stackName,
+        config.availability_zones,
+        config.public_prefixes,
+        config.privateVpcCidr,
+        getattr(config, "subnet_sizes", {}),
+        getattr(config, "cidr_map", {}),
+        config.all_availability_zones,
+        getattr(config, "availability_zone_slots", None),
+    ], sort_keys=True, default=repr)
+
+
+def load(config=None):
+    """The topology of config (default: the imported config module), computed once per set of inputs."""
+    global _cached
+    config = config or sys.modules["config"]
+    key = inputs(config)
+    if _cached is None or _cached[0] != key:
+        _cached = (key, Topology(config))
+    return _cached[1]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Uploads generated templates to S3, skipping the ones that did not change
+#
+import sys
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)) + '/../config')
+
+MANIFEST_KEY = "manifest.json"
+CONTENT_TYPES = {
+    ".json": "application/json",
+    ".yaml": "application/yaml",
+    ".yml": "application/yaml",
+}
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_type(path):
+    """By extension, .cfn templates by their first byte since build.py writes every --format to .cfn."""
+    extension = os.path.splitext(path)[1]
+    if extension in CONTENT_TYPES:
+        return CONTENT_TYPES[extension]
+    with open(path, "rb") as f:
+        return "application/json" if f.read(1) == b"{" else "application/yaml"
+
+
+def make_client(endpoint_url=None, jobs=4):
+    """One client for all uploads, its connection pool sized for the worker threads."""
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url or os.environ.get("AWS_ENDPOINT_URL"),
+        config=Config(max_pool_connections=max(jobs, 10)),
+    )
+
+
+def load_manifest(client, bucket, key=MANIFEST_KEY, local=None):
+    """Returns {object key: sha256} from a local file, or from the object stored next to the templates."""
+    if local:
+        if not os.path.exists(local):
+            return {}
+        with open(local) as f:
+            return json.load(f)
+
+    try:
+        response = client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {}
+        raise
+    return json.loads(response["Body"].read())
+
+
+def save_manifest(client, manifest, bucket, key=MANIFEST_KEY, local=None):
+    body = json.dumps(manifest, indent=2, sort_keys=True)
+    if local:
+        with open(local, "w") as f:
+            f.write(body + "\n")
+    else:
+        client.put_object(Bucket=bucket, Key=key, Body=body.encode(), ContentType="application/json")
+
+
+def upload_file(client, bucket, path, key, digest):
+    with open(path, "rb") as f:
+        client.put_object(Bucket=bucket, Key=key, Body=f, ContentType=content_type(path),
+                          Metadata={"sha256": digest})
+    return key
+
+
+def upload_changed(client, bucket, paths, prefix="", manifest_key=None, local_manifest=None, jobs=4, force=False):
+    """Uploads files whose hash differs from the manifest, returns (uploaded, skipped) key lists."""
+    manifest_key = manifest_key or prefix + MANIFEST_KEY
+    manifest = load_manifest(client, bucket, manifest_key, local_manifest)
+
+    changed = []
+    skipped = []
+    for path in paths:
+        key = prefix + os.path.basename(path)
+        digest = file_digest(path)
+        if not force and manifest.get(key) == digest:
+            skipped.append(key)
+        else:
+            changed.append((path, key, digest))
+
+    if changed:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            uploaded = list(executor.map(lambda item: upload_file(client, bucket, *item), changed))
+
+        # Only record hashes once every changed object is in place
+        for path, key, digest in changed:
+            manifest[key] = digest
+        save_manifest(client, manifest, bucket, manifest_key, local_manifest)
+    else:
+        uploaded = []
+
+    return uploaded, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload changed templates to S3.")
+    parser.add_argument("files", nargs="+", help="template files to upload")
+    parser.add_argument("-b", "--bucket", help="target bucket (default: s3Bucket from config)")
+    parser.add_argument("-p", "--prefix", default="", help="key prefix inside the bucket")
+    parser.add_argument("-m", "--manifest", help="keep the hash manifest in this local file instead of the bucket")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("-f", "--force", action="store_true", help="upload even if unchanged")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local MinIO or moto server")
+    args = parser.parse_args(argv)
+
+    bucket = args.bucket
+    if not bucket:
+        from config import s3Bucket as bucket
+
+    client = make_client(args.endpoint_url, args.jobs)
+    uploaded, skipped = upload_changed(client, bucket, args.files, args.prefix,
+                                       local_manifest=args.manifest, jobs=args.jobs, force=args.force)
+
+    for key in uploaded:
+        print("uploaded  s3://%s/%s" % (bucket, key))
+    for key in skipped:
+        print("unchanged s3://%s/%s" % (bucket, key))
+
+
+if __name__ == "__main__":
+    main()
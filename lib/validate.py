@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# Pre-flight check of the nested stack wiring between generated templates
+#
+# Indexes the parameters, resources and outputs of every template in a build
+# directory, then checks in one pass that every Ref points at something that
+# exists, that every nested Stack only passes parameters its template declares
+# and supplies the ones without a default, and that every
+# GetAtt(stack, "Outputs.x") names an output the child template really has.
+#
+import sys
+import os
+import argparse
+
+import diff
+import shard
+
+PSEUDO_PARAMETER = "AWS::"
+
+
+def intrinsics(value):
+    """Yields (function, logical id, attribute) for every Ref, Fn::GetAtt and Fn::Sub variable in value."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "Ref":
+                yield "Ref", item, None
+            elif key == "Fn::GetAtt":
+                resource, attribute = item if isinstance(item, list) else item.split(".", 1)
+                yield "Fn::GetAtt", resource, attribute
+            elif key == "Fn::Sub":
+                text, variables = shard.sub_parts(item)
+                for variable in shard.SUB_VARIABLE.findall(text):
+                    if variable not in variables:
+                        resource, _, attribute = variable.partition(".")
+                        yield "Fn::Sub", resource, attribute or None
+                for found in intrinsics(variables):
+                    yield found
+            elif key == "Fn::ImportValue":
+                yield "Fn::ImportValue", item, None
+            else:
+                for found in intrinsics(item):
+                    yield found
+    elif isinstance(value, list):
+        for item in value:
+            for found in intrinsics(item):
+                yield found
+
+
+def child_template(template, stack, templates):
+    """Returns the name of the template a Stack resource deploys, if it is part of the build."""
+    url = stack.get("Properties", {}).get("TemplateURL")
+    if isinstance(url, dict) and "Ref" in url:
+        url = template.get("Parameters", {}).get(url["Ref"], {}).get("Default")
+    if not isinstance(url, str):
+        return None
+    name = url.rsplit("/", 1)[-1]
+    return name if name in templates else None
+
+
+def validate(templates):
+    """Returns (errors, warnings) for a {filename: template dict} build."""
+    errors = []
+    warnings = []
+
+    exports = {}
+    for name, template in templates.items():
+        for output_name, output in template.get("Outputs", {}).items():
+            export = output.get("Export", {}).get("Name")
+            if isinstance(export, dict) and "Fn::Sub" in export and "${" not in str(export["Fn::Sub"]):
+                export = export["Fn::Sub"]
+            if isinstance(export, str):
+                exports[export] = (name, output_name)
+
+    consumed = set()
+    imported = set()
+    for name, template in sorted(templates.items()):
+        parameters = template.get("Parameters", {})
+        resources = template.get("Resources", {})
+        used = set()
+
+        stacks = {}
+        for logical_id, resource in resources.items():
+            if resource.get("Type") == "AWS::CloudFormation::Stack":
+                child = child_template(template, resource, templates)
+                if child:
+                    stacks[logical_id] = child
+
+        for section in ("Resources", "Outputs", "Conditions"):
+            for logical_id, value in template.get(section, {}).items():
+                for function, target, attribute in intrinsics(value):
+                    where = "%s: %s %s" % (name, section[:-1].lower(), logical_id)
+                    if function == "Fn::ImportValue":
+                        if isinstance(target, str):
+                            if target in exports:
+                                imported.add(exports[target])
+                            else:
+                                errors.append("%s imports %s, no template exports it" % (where, target))
+                        continue
+                    if target.startswith(PSEUDO_PARAMETER):
+                        continue
+                    if target in parameters:
+                        used.add(target)
+                        continue
+                    if target not in resources:
+                        errors.append("%s references %s, which is neither a parameter nor a resource" % (where, target))
+                        continue
+                    if target in stacks and attribute and attribute.startswith("Outputs."):
+                        output = attribute[len("Outputs."):]
+                        child = templates[stacks[target]]
+                        if output in child.get("Outputs", {}):
+                            consumed.add((stacks[target], output))
+                        else:
+                            errors.append("%s reads %s.%s, but %s has no such output" % (
+                                where, target, attribute, stacks[target]))
+
+        for logical_id, child in sorted(stacks.items()):
+            declared = templates[child].get("Parameters", {})
+            passed = resources[logical_id].get("Properties", {}).get("Parameters", {})
+            for parameter in sorted(passed):
+                if parameter not in declared:
+                    errors.append("%s: stack %s passes %s, which %s does not declare" % (
+                        name, logical_id, parameter, child))
+            for parameter in sorted(declared):
+                if parameter not in passed and "Default" not in declared[parameter]:
+                    errors.append("%s: stack %s does not pass %s, which %s requires" % (
+                        name, logical_id, parameter, child))
+
+        for parameter in sorted(parameters):
+            if parameter not in used:
+                warnings.append("%s: parameter %s is never used" % (name, parameter))
+
+    # Outputs of nested templates that nobody reads or imports
+    children = set()
+    for name, template in templates.items():
+        for resource in template.get("Resources", {}).values():
+            if resource.get("Type") == "AWS::CloudFormation::Stack":
+                children.add(child_template(template, resource, templates))
+    for name in sorted(children - set([None])):
+        for output_name, output in sorted(templates[name].get("Outputs", {}).items()):
+            if (name, output_name) not in consumed and (name, output_name) not in imported and "Export" not in output:
+                warnings.append("%s: output %s is never read" % (name, output_name))
+
+    return errors, warnings
+
+
+def load_build(directory):
+    return dict((filename, diff.load(os.path.join(directory, filename)))
+                for filename in sorted(os.listdir(directory)) if filename.endswith(".cfn"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check references between the generated nested stack templates.")
+    parser.add_argument("directory", nargs="?", default="jsons", help="build directory (default: jsons)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print errors")
+    args = parser.parse_args(argv)
+
+    errors, warnings = validate(load_build(args.directory))
+    if not args.quiet:
+        for warning in warnings:
+            print("[W] " + warning)
+    for error in errors:
+        print("[E] " + error)
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/bin/bash
+# Shared by the hook scripts
+. "$(dirname "$0")/deploy.conf"
+
+function nginx_running {
+    [ -f "$NGINX_PID" ] && kill -0 "$(cat "$NGINX_PID")" 2>/dev/null
+}
+
+function wait_healthy {
+    local deadline=$(( $(date +%s) + HEALTH_TIMEOUT ))
+    until curl -fsS -o /dev/null --max-time 2 "$HEALTH_URL"; do
+        if [ "$(date +%s)" -ge "$deadline" ]; then
+            echo "[E] $HEALTH_URL did not answer within ${HEALTH_TIMEOUT}s"
+            return 1
+        fi
+        sleep 1
+    done
+}
+
+# Starts a new master from the replaced binary next to the old one, stops
+# the old workers so only the new ones answer the health check, then
+# retires the old master once they do
+function nginx_upgrade {
+    local old
+    old=$(cat "$NGINX_PID")
+    kill -USR2 "$old"
+    for i in $(seq 1 10); do
+        [ -f "$NGINX_PID.oldbin" ] && break
+        sleep 1
+    done
+    if [ ! -f "$NGINX_PID.oldbin" ]; then
+        echo "[E] new nginx master did not start"
+        return 1
+    fi
+    if ! nginx_running; then
+        # Died after writing its pid, the old workers still serve
+        echo "[E] new nginx master exited"
+        return 1
+    fi
+    kill -WINCH "$old"
+    if ! wait_healthy; then
+        # Old master starts its workers again, the new one goes away
+        kill -HUP "$old"
+        kill -QUIT "$(cat "$NGINX_PID")"
+        return 1
+    fi
+    kill -QUIT "$old"
+}
@@ -1,2 +1,28 @@
 #!/bin/bash
+. "$(dirname "$0")/common.sh"
+
+if [ "$DEPLOY_MODE" = "restart" ] || ! nginx_running; then
+    service nginx start
+    wait_healthy
+    exit $?
+fi
+
+# A broken config is refused here, the running nginx keeps the old one
+nginx -t || exit 1
+
+if readlink "/proc/$(cat "$NGINX_PID")/exe" | grep -q "(deleted)$"; then
+    # The package replaced the binary, upgrade without dropping connections.
+    # A failed upgrade leaves the old master serving, fail the deployment
+    # rather than restarting onto the binary that just failed.
+    nginx_upgrade
+    exit $?
+elif nginx -s reload; then
+    # Unhealthy after a reload is the new revision's fault, fail the deployment
+    wait_healthy
+    exit $?
+fi
+
+echo "[W] graceful reload failed, falling back to stop/start"
+service nginx stop
 service nginx start
+wait_healthy
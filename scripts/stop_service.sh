@@ -1,2 +1,7 @@
 #!/bin/bash
-service nginx stop
+. "$(dirname "$0")/common.sh"
+
+# In reload mode nginx keeps serving until ApplicationStart swaps the config in
+if [ "$DEPLOY_MODE" = "restart" ]; then
+    service nginx stop
+fi
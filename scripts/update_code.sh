@@ -1,3 +1,5 @@
 #!/bin/bash
-/opt/puppetlabs/bin/puppet agent --test
+# puppet from PATH first, so a stub can stand in for it
+PUPPET=$(command -v puppet || echo /opt/puppetlabs/bin/puppet)
+$PUPPET agent --test
 exit 0
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The lib/ modules import each other by name, like the generators do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
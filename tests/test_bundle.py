@@ -0,0 +1,106 @@
+import os
+import zipfile
+
+import pytest
+from botocore.exceptions import ClientError
+
+import bundle
+
+
+@pytest.fixture
+def revision(tmp_path):
+    """A revision tree like the repo's: appspec.yml and scripts/."""
+    (tmp_path / "scripts").mkdir()
+    (tmp_path / "appspec.yml").write_text("version: 0.0\nos: linux\n")
+    (tmp_path / "scripts" / "start_service.sh").write_text("#!/bin/bash\nservice nginx start\n")
+    (tmp_path / "scripts" / "deploy.conf").write_text("HEALTH_TIMEOUT=60\n")
+    return tmp_path
+
+
+def digest(root, tmp_path, name="revision.zip"):
+    return bundle.write_bundle(str(tmp_path / name), str(root))
+
+
+def test_same_content_gives_the_same_bundle_across_mtime_and_mode(revision, tmp_path):
+    first = digest(revision, tmp_path, "first.zip")
+
+    for path in (revision / "appspec.yml", revision / "scripts" / "start_service.sh"):
+        os.utime(str(path), (1, 1))
+        os.chmod(str(path), 0o600)
+    assert digest(revision, tmp_path, "second.zip") == first
+    assert (tmp_path / "first.zip").read_bytes() == (tmp_path / "second.zip").read_bytes()
+
+
+def test_content_change_changes_the_hash(revision, tmp_path):
+    first = digest(revision, tmp_path)
+    (revision / "scripts" / "deploy.conf").write_text("HEALTH_TIMEOUT=30\n")
+    assert digest(revision, tmp_path) != first
+
+
+def test_entries_are_sorted_with_fixed_timestamps_and_modes(revision, tmp_path):
+    digest(revision, tmp_path)
+    with zipfile.ZipFile(str(tmp_path / "revision.zip")) as archive:
+        infos = archive.infolist()
+
+    assert [info.filename for info in infos] == ["appspec.yml", "scripts/deploy.conf", "scripts/start_service.sh"]
+    for info in infos:
+        assert info.date_time == bundle.TIMESTAMP
+    modes = dict((info.filename, info.external_attr >> 16 & 0o777) for info in infos)
+    assert modes == {"appspec.yml": 0o644, "scripts/deploy.conf": 0o644, "scripts/start_service.sh": 0o755}
+
+
+class StubS3(object):
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+        self.uploads = []
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404", "Message": "stub"}}, "HeadObject")
+        return {}
+
+    def upload_file(self, path, bucket, key, Config=None, ExtraArgs=None):
+        self.uploads.append((key, Config.multipart_threshold, ExtraArgs))
+        self.keys.add(key)
+
+
+def test_upload_is_skipped_when_the_key_exists(revision, tmp_path):
+    sha256 = digest(revision, tmp_path)
+    client = StubS3()
+    path = str(tmp_path / "revision.zip")
+
+    key, uploaded = bundle.upload_bundle(client, "code", path, sha256, "revisions/")
+    assert (key, uploaded) == ("revisions/%s.zip" % sha256, True)
+    assert client.uploads == [(key, bundle.MULTIPART_THRESHOLD,
+                               {"ContentType": "application/zip", "Metadata": {"sha256": sha256}})]
+
+    assert bundle.upload_bundle(client, "code", path, sha256, "revisions/") == (key, False)
+    assert bundle.upload_bundle(client, "code", path, sha256, "revisions/", force=True) == (key, True)
+    assert len(client.uploads) == 2
+
+
+class StubCodeDeploy(object):
+    def __init__(self, key=None):
+        self.key = key
+        self.created = []
+
+    def get_deployment_group(self, applicationName, deploymentGroupName):
+        info = {"lastSuccessfulDeployment": {"deploymentId": "d-1"}} if self.key else {}
+        return {"deploymentGroupInfo": info}
+
+    def get_deployment(self, deploymentId):
+        return {"deploymentInfo": {"revision": bundle.revision("code", self.key)}}
+
+    def create_deployment(self, applicationName, deploymentGroupName, revision):
+        self.created.append(revision["s3Location"]["key"])
+        return {"deploymentId": "d-2"}
+
+
+def test_deploy_is_skipped_when_the_group_runs_the_revision():
+    assert bundle.deploy(StubCodeDeploy("revisions/a.zip"), "alen", "web", "code", "revisions/a.zip") is None
+
+    codedeploy = StubCodeDeploy("revisions/a.zip")
+    assert bundle.deploy(codedeploy, "alen", "web", "code", "revisions/b.zip") == "d-2"
+    assert codedeploy.created == ["revisions/b.zip"]
+
+    assert bundle.deploy(StubCodeDeploy(), "alen", "web", "code", "revisions/a.zip") == "d-2"
@@ -0,0 +1,98 @@
+import ipaddress
+
+import pytest
+
+import cidr
+
+ZONES = ["eu-west-1a", "eu-west-1b", "eu-west-1c"]
+
+
+def networks(subnets):
+    return [ipaddress.ip_network(value) for zone in subnets.values() for value in zone["public"].values()]
+
+
+def test_every_zone_and_prefix_gets_a_disjoint_subnet_inside_the_vpc():
+    subnets = cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod", "ops"], sizes={"ops": 26})
+
+    assert sorted(subnets) == ZONES
+    allocated = networks(subnets)
+    assert len(allocated) == 9
+    for network in allocated:
+        assert network.subnet_of(ipaddress.ip_network("10.10.0.0/16"))
+    for i, network in enumerate(allocated):
+        for other in allocated[i + 1:]:
+            assert not network.overlaps(other)
+    assert subnets["eu-west-1a"]["public"]["ops"].endswith("/26")
+    assert subnets["eu-west-1a"]["public"]["dev"].endswith("/24")
+
+
+def test_allocation_is_deterministic():
+    first = cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod"])
+    assert cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod"]) == first
+
+
+def test_adding_an_availability_zone_moves_nothing():
+    slots = cidr.zone_slots(ZONES)
+    before = cidr.allocate("10.10.0.0/16", ZONES[:2], ["dev", "prod"], max_availability_zones=slots)
+    after = cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod"], max_availability_zones=slots)
+
+    for zone in ZONES[:2]:
+        assert after[zone] == before[zone]
+    assert "eu-west-1c" in after
+
+
+def test_appending_a_prefix_moves_nothing():
+    before = cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod"])
+    after = cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod", "ops"])
+
+    for zone in ZONES:
+        for prefix in ("dev", "prod"):
+            assert after[zone]["public"][prefix] == before[zone]["public"][prefix]
+
+
+def test_pinned_subnets_stay_and_the_rest_is_placed_around_them():
+    cidr_map = {"eu-west-1a": {"public": {"dev": 0}}, "eu-west-1c": {"public": {"dev": 2}}}
+    subnets = cidr.allocate("10.10.0.0/16", ZONES[:2], ["dev", "prod"], cidr_map=cidr_map)
+
+    assert subnets["eu-west-1a"]["public"]["dev"] == "10.10.0.0/24"
+    # The pin of the unused zone is still kept free
+    for network in networks(subnets):
+        assert not network.overlaps(ipaddress.ip_network("10.10.2.0/24"))
+        if network != ipaddress.ip_network("10.10.0.0/24"):
+            assert not network.overlaps(ipaddress.ip_network("10.10.0.0/24"))
+
+
+def test_zone_slots_cover_the_region_letters_in_a_power_of_two():
+    assert cidr.zone_slots(ZONES) == 4
+    assert cidr.zone_slots(["us-east-1a", "us-east-1f"]) == 8
+    assert cidr.zone_slots(["eu-north-1a"]) == 1
+    assert cidr.zone_slots(ZONES, 16) == 16
+
+
+def test_slots_follow_the_zone_count():
+    # 3 zones reserve 4 slots, so a /16 fits 64 /24 prefixes
+    prefixes = ["p%d" % i for i in range(64)]
+    subnets = cidr.allocate("10.10.0.0/16", ZONES, prefixes, max_availability_zones=cidr.zone_slots(ZONES))
+    assert len(networks(subnets)) == 64 * 3
+
+
+def test_overflow_is_reported():
+    prefixes = ["p%d" % i for i in range(65)]
+    with pytest.raises(ValueError, match="no room left for a /22"):
+        cidr.allocate("10.10.0.0/16", ZONES, prefixes, max_availability_zones=cidr.zone_slots(ZONES))
+
+
+def test_zone_outside_the_slots_is_reported():
+    with pytest.raises(ValueError, match="cannot place availability zone eu-west-1c in 2 slots"):
+        cidr.allocate("10.10.0.0/16", ZONES, ["dev"], max_availability_zones=2)
+
+
+def test_overlapping_pins_are_reported():
+    cidr_map = {"eu-west-1a": {"public": {"dev": 5, "prod": 5}}}
+    with pytest.raises(ValueError, match="overlaps"):
+        cidr.allocate("10.10.0.0/16", ZONES, ["dev", "prod"], cidr_map=cidr_map)
+
+
+def test_subnet_sizes_larger_than_the_vpc_are_reported():
+    with pytest.raises(ValueError, match="no room left"):
+        cidr.allocate("10.10.0.0/24", ZONES, ["dev"], sizes={"dev": 23})
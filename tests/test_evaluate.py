@@ -0,0 +1,129 @@
+import base64
+
+import pytest
+
+import evaluate
+
+
+def infra_template():
+    """The shapes the generators emit: Join Name tags, Split subnet lists, Base64 UserData, nested stacks."""
+    return {
+        "Parameters": {
+            "stackName": {"Type": "String"},
+            "environment": {"Type": "String", "Default": "development", "AllowedValues": ["development", "production"]},
+            "pubsubDEV": {"Type": "String"},
+            "networkUrl": {"Type": "String", "Default": "https://bucket.s3.amazonaws.com/network.cfn"},
+        },
+        "Conditions": {
+            "production": {"Fn::Equals": [{"Ref": "environment"}, "production"]},
+        },
+        "Resources": {
+            "networkStack": {
+                "Type": "AWS::CloudFormation::Stack",
+                "Properties": {"TemplateURL": {"Ref": "networkUrl"}, "Parameters": {"stackName": {"Ref": "stackName"}}},
+            },
+            "vpc": {
+                "Type": "AWS::EC2::VPC",
+                "Properties": {"Tags": [{"Key": "Name", "Value": {"Fn::Join": ["", [{"Ref": "stackName"}, "-vpc"]]}}]},
+            },
+            "group": {
+                "Type": "AWS::AutoScaling::AutoScalingGroup",
+                "Properties": {
+                    "VPCZoneIdentifier": {"Fn::Split": [",", {"Ref": "pubsubDEV"}]},
+                    "MinSize": {"Fn::If": ["production", 2, 1]},
+                    "HealthCheckGracePeriod": {"Fn::If": ["production", 300, {"Ref": "AWS::NoValue"}]},
+                },
+            },
+            "launch": {
+                "Type": "AWS::AutoScaling::LaunchConfiguration",
+                "Properties": {
+                    "UserData": {"Fn::Base64": {"Fn::Join": [
+                        "", ["#!/bin/bash\n", "region=", {"Ref": "AWS::Region"}]]}},
+                    "SecurityGroups": [{"Fn::GetAtt": ["networkStack", "Outputs.serverSG"]}],
+                },
+            },
+            "alarm": {
+                "Type": "AWS::CloudWatch::Alarm",
+                "Condition": "production",
+                "Properties": {"AlarmName": {"Fn::Sub": "${stackName}-${group}-${vpc.CidrBlock}"}},
+            },
+        },
+        "Outputs": {
+            "vpcId": {"Value": {"Ref": "vpc"}},
+            "subnets": {"Value": {"Fn::Select": [1, {"Fn::Split": [",", {"Ref": "pubsubDEV"}]}]}},
+        },
+    }
+
+
+def network_template():
+    return {
+        "Parameters": {"stackName": {"Type": "String"}},
+        "Resources": {"serverSG": {"Type": "AWS::EC2::SecurityGroup", "Properties": {}}},
+        "Outputs": {"serverSG": {"Value": {"Fn::Join": ["-", [{"Ref": "stackName"}, {"Ref": "serverSG"}]]}}},
+    }
+
+
+PARAMETERS = {"stackName": "alen", "pubsubDEV": "subnet-a,subnet-b"}
+OUTPUTS = {"networkStack": {"serverSG": "sg-123"}}
+
+
+def test_join_split_and_base64_resolve():
+    resources = evaluate.evaluate(infra_template(), PARAMETERS, outputs=OUTPUTS)["Resources"]
+
+    assert resources["vpc"]["Properties"]["Tags"] == [{"Key": "Name", "Value": "alen-vpc"}]
+    assert resources["group"]["Properties"]["VPCZoneIdentifier"] == ["subnet-a", "subnet-b"]
+    user_data = base64.b64decode(resources["launch"]["Properties"]["UserData"]).decode()
+    assert user_data == "#!/bin/bash\nregion=eu-west-1"
+
+
+def test_nested_stack_outputs_come_from_the_stubs():
+    result = evaluate.evaluate(infra_template(), PARAMETERS, outputs=OUTPUTS)
+
+    assert result["Resources"]["launch"]["Properties"]["SecurityGroups"] == ["sg-123"]
+    assert result["Stacks"] == {}
+
+
+def test_nested_stack_outputs_are_evaluated_from_the_child_template():
+    templates = {"network.cfn": network_template()}
+    result = evaluate.evaluate(infra_template(), PARAMETERS, stack_name="alen", templates=templates,
+                               attributes={"vpc": {"Ref": "vpc-1"}})
+
+    assert result["Resources"]["launch"]["Properties"]["SecurityGroups"] == ["alen-serverSG"]
+    assert result["Stacks"]["networkStack"]["Parameters"] == {"stackName": "alen"}
+    assert result["Outputs"]["vpcId"] == "vpc-1"
+
+
+def test_conditions_drop_resources_and_no_value_properties():
+    development = evaluate.evaluate(infra_template(), PARAMETERS, outputs=OUTPUTS)
+    assert "alarm" not in development["Resources"]
+    assert "HealthCheckGracePeriod" not in development["Resources"]["group"]["Properties"]
+    assert development["Resources"]["group"]["Properties"]["MinSize"] == 1
+
+    production = evaluate.evaluate(infra_template(), dict(PARAMETERS, environment="production"), outputs=OUTPUTS,
+                                   attributes={"vpc": {"CidrBlock": "10.10.0.0/16"}})
+    assert production["Conditions"] == {"production": True}
+    assert production["Resources"]["group"]["Properties"]["HealthCheckGracePeriod"] == 300
+    assert production["Resources"]["alarm"]["Properties"]["AlarmName"] == "alen-group-10.10.0.0/16"
+
+
+def test_parameter_combinations():
+    template = infra_template()
+    for i in range(200):
+        subnets = ",".join("subnet-%d" % j for j in range(i % 4 + 2))
+        result = evaluate.evaluate(template, {"stackName": "s%d" % i, "pubsubDEV": subnets}, outputs=OUTPUTS)
+        assert result["Resources"]["group"]["Properties"]["VPCZoneIdentifier"] == subnets.split(",")
+        assert result["Outputs"]["subnets"] == "subnet-1"
+
+
+def test_bad_parameters_are_reported():
+    with pytest.raises(ValueError, match="pubsubDEV has no value"):
+        evaluate.evaluate(infra_template(), {"stackName": "alen"}, outputs=OUTPUTS)
+    with pytest.raises(ValueError, match="is not one of"):
+        evaluate.evaluate(infra_template(), dict(PARAMETERS, environment="staging"), outputs=OUTPUTS)
+    with pytest.raises(ValueError, match="unknown parameters: other"):
+        evaluate.evaluate(infra_template(), dict(PARAMETERS, other="x"), outputs=OUTPUTS)
+
+
+def test_missing_stack_output_is_reported():
+    with pytest.raises(ValueError, match="stack networkStack has no output serverSG"):
+        evaluate.evaluate(infra_template(), PARAMETERS, outputs={"networkStack": {}})
@@ -0,0 +1,150 @@
+import copy
+
+import pytest
+
+import shard
+
+
+def synthetic_template(count=12):
+    """A chain of queues, each referencing the one before it, so splitting has to cut references."""
+    resources = {}
+    for i in range(count):
+        properties = {"QueueName": {"Fn::Sub": "${stackName}-queue%d" % i}}
+        if i:
+            properties["RedrivePolicy"] = {
+                "deadLetterTargetArn": {"Fn::GetAtt": ["queue%d" % (i - 1), "Arn"]},
+                "source": {"Ref": "queue%d" % (i - 1)},
+            }
+        resources["queue%d" % i] = {"Type": "AWS::SQS::Queue", "Properties": properties}
+    resources["queue%d" % (count - 1)]["DependsOn"] = "queue0"
+    return {
+        "AWSTemplateFormatVersion": "2010-09-09",
+        "Description": "Synthetic",
+        "Parameters": {"stackName": {"Type": "String"}},
+        "Resources": resources,
+        "Outputs": {"lastQueue": {"Value": {"Fn::GetAtt": ["queue%d" % (count - 1), "Arn"]}}},
+    }
+
+
+def synthetic_parent():
+    return {
+        "Parameters": {
+            "queuesUrl": {"Type": "String", "Default": "https://bucket.s3.amazonaws.com/queues.cfn"},
+        },
+        "Resources": {
+            "queuesStack": {
+                "Type": "AWS::CloudFormation::Stack",
+                "Properties": {
+                    "TemplateURL": {"Ref": "queuesUrl"},
+                    "Parameters": {"stackName": {"Ref": "AWS::StackName"}},
+                },
+            },
+            "consumer": {
+                "Type": "AWS::SQS::Queue",
+                "DependsOn": "queuesStack",
+                "Properties": {"QueueName": {"Fn::GetAtt": ["queuesStack", "Outputs.lastQueue"]}},
+            },
+        },
+    }
+
+
+def local_names(child):
+    return set(child["template"]["Resources"]) | set(child["template"].get("Parameters", {}))
+
+
+def test_small_template_is_left_alone():
+    template = synthetic_template(3)
+    assert not shard.needs_sharding(template, max_resources=10)
+    assert shard.needs_sharding(template, max_resources=2)
+
+
+def test_parts_respect_the_resource_limit_and_keep_every_resource():
+    template = synthetic_template()
+    children = shard.shard(template, max_resources=5)
+
+    assert len(children) == 3
+    names = [name for child in children for name in child["template"]["Resources"]]
+    assert sorted(names) == sorted(template["Resources"])
+    for child in children:
+        assert len(child["template"]["Resources"]) <= 5
+
+
+def test_every_cross_part_reference_is_exported_and_imported():
+    children = shard.shard(synthetic_template(), max_resources=5)
+
+    for i, child in enumerate(children):
+        for resource in child["template"]["Resources"].values():
+            # Only local resources, parameters and pseudo parameters are left to reference
+            for name in shard.references(resource):
+                assert name in local_names(child) or name.startswith("AWS::"), (i, name)
+        for parameter, (source, output) in child["imports"].items():
+            assert source != i
+            assert output in children[source]["template"]["Outputs"]
+            assert parameter in child["template"]["Parameters"]
+
+
+def test_imported_getatt_keeps_its_attribute():
+    children = shard.shard(synthetic_template(), max_resources=5)
+
+    exported = dict((name, value) for child in children
+                    for name, value in child["template"].get("Outputs", {}).items())
+    assert exported["queue4Arn"] == {"Value": {"Fn::GetAtt": ["queue4", "Arn"]}}
+    assert exported["queue4"] == {"Value": {"Ref": "queue4"}}
+
+
+def test_cross_part_depends_on_becomes_a_stack_dependency():
+    children = shard.shard(synthetic_template(), max_resources=5)
+
+    last = children[-1]
+    assert "DependsOn" not in last["template"]["Resources"]["queue11"]
+    assert 0 in last["depends"]
+
+
+def test_outputs_follow_the_resource_they_reference():
+    children = shard.shard(synthetic_template(), max_resources=5)
+    assert "lastQueue" in children[-1]["template"]["Outputs"]
+
+
+def test_parameter_and_output_limits_are_enforced(monkeypatch):
+    monkeypatch.setattr(shard, "MAX_OUTPUTS", 1)
+    with pytest.raises(ValueError, match="outputs"):
+        shard.shard(synthetic_template(), max_resources=5)
+
+
+def test_wire_parent_replaces_the_stack_with_wired_children():
+    children = shard.shard(synthetic_template(), max_resources=5)
+    parent = synthetic_parent()
+
+    assert shard.wire_parent(parent, "queues", children)
+
+    resources = parent["Resources"]
+    assert "queuesStack" not in resources
+    assert "queuesUrl" not in parent["Parameters"]
+    for i, child in enumerate(children):
+        stack = resources["queuesStack%d" % (i + 1)]
+        assert parent["Parameters"]["queuesUrl%d" % (i + 1)]["Default"].endswith("/queues-%d.cfn" % (i + 1))
+        assert stack["Properties"]["TemplateURL"] == {"Ref": "queuesUrl%d" % (i + 1)}
+
+        # Every parameter of the child is passed: imports from the sibling's outputs, the rest as before
+        passed = stack["Properties"].get("Parameters", {})
+        assert set(passed) == set(child["template"].get("Parameters", {}))
+        for parameter, (source, output) in child["imports"].items():
+            # The GetAtt alone orders the stacks
+            assert passed[parameter] == {"Fn::GetAtt": ["queuesStack%d" % (source + 1), "Outputs." + output]}
+        if "stackName" in passed:
+            assert passed["stackName"] == {"Ref": "AWS::StackName"}
+        if child["depends"]:
+            assert stack["DependsOn"] == ["queuesStack%d" % (j + 1) for j in sorted(child["depends"])]
+
+    # Users of the old stack now point at the child holding the output and wait for every child
+    consumer = resources["consumer"]
+    assert consumer["Properties"]["QueueName"] == {
+        "Fn::GetAtt": ["queuesStack%d" % len(children), "Outputs.lastQueue"]}
+    assert consumer["DependsOn"] == ["queuesStack%d" % (i + 1) for i in range(len(children))]
+
+
+def test_wire_parent_without_the_stack():
+    parent = synthetic_parent()
+    before = copy.deepcopy(parent)
+    assert not shard.wire_parent(parent, "other", shard.shard(synthetic_template(), max_resources=5))
+    assert parent == before
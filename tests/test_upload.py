@@ -0,0 +1,121 @@
+import io
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import upload
+
+
+class StubS3(object):
+    """The part of the S3 client upload.py uses, objects kept in a dict."""
+
+    def __init__(self, fail=None):
+        self.objects = {}
+        self.puts = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType, Metadata=None):
+        if Key == self.fail:
+            raise ClientError({"Error": {"Code": "500", "Message": "stub"}}, "PutObject")
+        body = Body if isinstance(Body, bytes) else Body.read()
+        with self.lock:
+            self.objects[(Bucket, Key)] = {"Body": body, "ContentType": ContentType, "Metadata": Metadata}
+            self.puts.append(Key)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "stub"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)]["Body"])}
+
+
+@pytest.fixture
+def templates(tmp_path):
+    paths = []
+    for name in ("general", "infra", "main", "network"):
+        path = tmp_path / (name + ".cfn")
+        path.write_text('{"Description": "%s"}\n' % name)
+        paths.append(str(path))
+    return paths
+
+
+def manifest(client, key="manifest.json"):
+    return json.loads(client.objects[("bucket", key)]["Body"])
+
+
+def test_first_upload_sends_everything_and_records_the_hashes(templates):
+    client = StubS3()
+    uploaded, skipped = upload.upload_changed(client, "bucket", templates)
+
+    assert sorted(uploaded) == ["general.cfn", "infra.cfn", "main.cfn", "network.cfn"]
+    assert skipped == []
+    assert manifest(client) == dict((key, upload.file_digest(path)) for key, path in zip(sorted(uploaded), templates))
+    assert client.objects[("bucket", "main.cfn")]["Metadata"] == {"sha256": upload.file_digest(templates[2])}
+
+
+def test_unchanged_templates_are_skipped(templates):
+    client = StubS3()
+    upload.upload_changed(client, "bucket", templates)
+    client.puts = []
+
+    uploaded, skipped = upload.upload_changed(client, "bucket", templates)
+    assert uploaded == []
+    assert len(skipped) == 4
+    # Not even the manifest is written again
+    assert client.puts == []
+
+
+def test_only_changed_templates_are_sent(templates):
+    client = StubS3()
+    upload.upload_changed(client, "bucket", templates)
+    client.puts = []
+    with open(templates[1], "a") as f:
+        f.write(" ")
+
+    uploaded, skipped = upload.upload_changed(client, "bucket", templates)
+    assert uploaded == ["infra.cfn"]
+    assert sorted(client.puts) == ["infra.cfn", "manifest.json"]
+    assert manifest(client)["infra.cfn"] == upload.file_digest(templates[1])
+
+
+def test_force_sends_unchanged_templates(templates):
+    client = StubS3()
+    upload.upload_changed(client, "bucket", templates)
+
+    uploaded, skipped = upload.upload_changed(client, "bucket", templates, force=True)
+    assert len(uploaded) == 4
+    assert skipped == []
+
+
+def test_prefix_and_local_manifest(templates, tmp_path):
+    client = StubS3()
+    local = str(tmp_path / "manifest.json")
+    upload.upload_changed(client, "bucket", templates, prefix="alen/", local_manifest=local)
+
+    assert ("bucket", "alen/main.cfn") in client.objects
+    assert ("bucket", "alen/manifest.json") not in client.objects
+    with open(local) as f:
+        assert sorted(json.load(f)) == ["alen/general.cfn", "alen/infra.cfn", "alen/main.cfn", "alen/network.cfn"]
+    assert upload.upload_changed(client, "bucket", templates, prefix="alen/", local_manifest=local)[0] == []
+
+
+def test_failed_upload_records_no_hashes(templates):
+    client = StubS3(fail="main.cfn")
+    with pytest.raises(ClientError):
+        upload.upload_changed(client, "bucket", templates)
+    assert ("bucket", "manifest.json") not in client.objects
+
+
+def test_content_type_follows_the_format(tmp_path):
+    yaml_template = tmp_path / "main.cfn"
+    yaml_template.write_text("Description: main\n")
+    json_template = tmp_path / "infra.cfn"
+    json_template.write_text('{"Description": "infra"}')
+    client = StubS3()
+    upload.upload_changed(client, "bucket", [str(yaml_template), str(json_template)])
+
+    assert client.objects[("bucket", "main.cfn")]["ContentType"] == "application/yaml"
+    assert client.objects[("bucket", "infra.cfn")]["ContentType"] == "application/json"
+    assert upload.content_type("template.yml") == "application/yaml"